@@ -4,16 +4,35 @@ Uses OpenAI to analyze skipped posts and generate configuration recommendations.
 """
 
 import os
+import re
 import json
-from typing import Dict, List, Any, Optional
-from openai import OpenAI
+import hashlib
+import httpx
+import orjson
+from typing import Dict, List, Any, Optional, AsyncIterator, Tuple
+from openai import AsyncOpenAI
+from pydantic import BaseModel, ConfigDict, ValidationError
 from dotenv import load_dotenv
 import dynamic_config
 import local_storage
+from llm_cache import cached_create, cached_stream
 
-load_dotenv()
+_client: Optional[AsyncOpenAI] = None
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+def _get_client() -> AsyncOpenAI:
+    """Get or create the OpenAI client on first use, so importing this module stays cheap."""
+    global _client
+    if _client is None:
+        load_dotenv()
+        # Long-lived HTTP/2 connection pool so repeated calls reuse one TCP+TLS connection
+        http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60.0),
+            timeout=60.0
+        )
+        _client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+    return _client
 
 SYSTEM_PROMPT = """You are an AI assistant helping to optimize a Reddit scanning system for Interview Query, a company that helps people prepare for data science, analytics, and tech interviews.
 
@@ -43,58 +62,152 @@ Posts that are NOT relevant include:
 When analyzing skipped posts, identify patterns and suggest specific changes."""
 
 
+class ChangeSet(BaseModel):
+    """Configuration changes that can be applied directly to the scanner config."""
+    # Strict structured outputs require every property to be listed and no extras allowed
+    model_config = ConfigDict(json_schema_extra={"additionalProperties": False})
+
+    add_keywords: List[str]
+    remove_keywords: List[str]
+    add_irrelevant_signals: List[str]
+    remove_subreddits: List[str]
+
+
+class Recommendations(ChangeSet):
+    """AI recommendations: the structured changes plus a short written analysis."""
+    analysis: str
+
+
+RECOMMENDATIONS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "Recommendations",
+        "schema": Recommendations.model_json_schema(),
+        "strict": True
+    }
+}
+
+RECOMMENDATION_PARAMS = {
+    "model": "gpt-4o",
+    "temperature": 0.7,
+    "max_tokens": 2000,
+    "response_format": RECOMMENDATIONS_RESPONSE_FORMAT
+}
+
+CHAT_PARAMS = {
+    "model": "gpt-4o",
+    "temperature": 0.7,
+    "max_tokens": 1500
+}
+
+# Last generate_recommendations result, returned again while its prompt is unchanged
+_last_recommendations = {"hash": None, "response": None}
+
+# Older conversation history is summarized into one system note, this many messages at a time
+HISTORY_KEEP_MESSAGES = 6
+
+NO_SKIPPED_MESSAGE = "No skipped posts with feedback to analyze yet."
+
+JSON_DECODER = json.JSONDecoder()
+
+CHANGE_KEYS = frozenset(ChangeSet.model_fields)
+
+JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+CODE_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+
 def get_skipped_opportunities() -> List[Dict[str, Any]]:
     """Get all opportunities that were skipped with feedback."""
     opportunities = local_storage.get_all_opportunities()
     return [opp for opp in opportunities if opp.get("status") == "skipped" and opp.get("feedback")]
 
 
-def generate_recommendations(conversation_history: List[Dict[str, str]] = None) -> Dict[str, Any]:
+async def _trim_history(conversation_history: List[Dict[str, str]] = None) -> Optional[List[Dict[str, str]]]:
     """
-    Generate AI recommendations based on skipped posts.
-    Can continue a conversation if history is provided.
+    Keep recent messages verbatim and replace older ones with a short summary.
+    The cut point moves in steps of HISTORY_KEEP_MESSAGES, so the summarized prefix stays
+    the same for several turns and its (cached) summary is only generated once per step.
     """
-    skipped = get_skipped_opportunities()
-    config_summary = dynamic_config.get_config_summary()
+    if not conversation_history:
+        return conversation_history
     
-    if not skipped:
-        return {
-            "success": True,
-            "message": "No skipped posts with feedback to analyze yet.",
-            "recommendations": [],
-            "conversation_id": None
-        }
+    cut = (len(conversation_history) - HISTORY_KEEP_MESSAGES) // HISTORY_KEEP_MESSAGES * HISTORY_KEEP_MESSAGES
+    if cut <= 0:
+        return conversation_history
     
-    # Build context about skipped posts
+    older = conversation_history[:cut]
+    recent = conversation_history[cut:]
+    transcript = "\n\n".join(f"{m.get('role')}: {m.get('content')}" for m in older)
+    
+    try:
+        response = await cached_create(
+            _get_client(),
+            model="gpt-4o-mini",
+            messages=[{
+                "role": "user",
+                "content": f"Summarize this conversation in at most 200 tokens, keeping any decisions and recommended changes, for use as context:\n\n{transcript}"
+            }],
+            temperature=0,
+            max_tokens=300
+        )
+        summary = response.choices[0].message.content
+    except Exception:
+        # Dropping the oldest turns is still better than failing the whole request
+        return recent
+    
+    return [{"role": "system", "content": f"Summary of the earlier conversation: {summary}"}] + recent
+
+
+def _build_skipped_context(skipped: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reduce skipped posts to the fields the AI needs."""
     skipped_context = []
     for opp in skipped[:20]:  # Limit to 20 most recent
-        skipped_context.append({
+        # Truncated aggressively: input tokens are paid on every call
+        context = {
             "subreddit": opp.get("subreddit"),
-            "title": opp.get("title"),
-            "text_snippet": opp.get("text_snippet", "")[:200],
-            "matched_keywords": opp.get("matched_keywords"),
+            "title": (opp.get("title") or "")[:120],
+            "text_snippet": (opp.get("text_snippet") or "")[:140],
             "feedback": opp.get("feedback")
-        })
-    
-    # Build the user message
-    user_message = f"""Please analyze these skipped posts and their feedback to recommend configuration changes.
+        }
+        if opp.get("matched_keywords"):
+            context["matched_keywords"] = opp["matched_keywords"]
+        skipped_context.append(context)
+    return skipped_context
+
 
-## Current Configuration Summary
+def _config_summary_section() -> str:
+    """Current configuration summary as a prompt section."""
+    config_summary = dynamic_config.get_config_summary()
+    return f"""## Current Configuration Summary
 - Total keywords: {config_summary['total_keywords']}
 - Total subreddits: {config_summary['total_subreddits']}
 - Total relevant signals: {config_summary['total_relevant_signals']}
-- Total irrelevant signals: {config_summary['total_irrelevant_signals']}
+- Total irrelevant signals: {config_summary['total_irrelevant_signals']}"""
+
+
+def _build_recommendation_messages(
+    skipped: List[Dict[str, Any]], conversation_history: List[Dict[str, str]] = None
+) -> Tuple[List[Dict[str, str]], int]:
+    """Build the recommendation prompt. Returns the messages and number of posts analyzed."""
+    skipped_context = _build_skipped_context(skipped)
+    skipped_json = orjson.dumps(skipped_context).decode()
+    
+    # Build the user message
+    user_message = f"""Please analyze these skipped posts and their feedback to recommend configuration changes.
+
+{_config_summary_section()}
 
 ## Skipped Posts with Feedback
-{json.dumps(skipped_context, indent=2)}
+{skipped_json}
 
-Based on this feedback, what specific changes would you recommend? Please provide:
-1. Keywords to add or remove
-2. Irrelevant signals to add
-3. Subreddits to remove (if any consistently produce irrelevant results)
-4. Any other pattern you notice
+Based on this feedback, what specific changes would you recommend? Respond with JSON containing:
+- "add_keywords" / "remove_keywords": keywords to add or remove
+- "add_irrelevant_signals": irrelevant signals to add
+- "remove_subreddits": subreddits to remove (if any consistently produce irrelevant results)
+- "analysis": a short explanation of the patterns you noticed and why you recommend these changes
 
-Format your recommendations as actionable items that can be approved and applied."""
+Leave a list empty if you have no changes of that kind. The JSON can be approved and applied as-is."""
 
     messages = [{"role": "system", "content": SYSTEM_PROMPT}]
     
@@ -103,23 +216,55 @@ Format your recommendations as actionable items that can be approved and applied
         messages.extend(conversation_history)
     
     messages.append({"role": "user", "content": user_message})
+    return messages, len(skipped_context)
+
+
+async def generate_recommendations(conversation_history: List[Dict[str, str]] = None, refresh: bool = False) -> Dict[str, Any]:
+    """
+    Generate AI recommendations based on skipped posts.
+    Can continue a conversation if history is provided.
+    Repeats with unchanged skipped posts and config return the last result unless refresh=True.
+    """
+    skipped = get_skipped_opportunities()
+    
+    if not skipped:
+        return {
+            "success": True,
+            "message": NO_SKIPPED_MESSAGE,
+            "recommendations": [],
+            "conversation_id": None
+        }
+    
+    conversation_history = await _trim_history(conversation_history)
+    messages, analyzed_count = _build_recommendation_messages(skipped, conversation_history)
+    
+    # The prompt embeds the skipped posts and config summary, so its hash changes whenever they do
+    prompt_hash = hashlib.sha256(messages[-1]["content"].encode()).hexdigest()
+    if not conversation_history and not refresh and prompt_hash == _last_recommendations["hash"]:
+        return _last_recommendations["response"]
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=2000
-        )
+        # Recommendations should reflect fresh feedback, so only exact repeats are served from cache
+        response = await cached_create(_get_client(), refresh=refresh, messages=messages, **RECOMMENDATION_PARAMS)
         
         ai_response = response.choices[0].message.content
+        recommendations = Recommendations.model_validate_json(ai_response)
         
-        return {
+        result = {
             "success": True,
+            # Raw JSON can be sent back to /api/admin/apply-changes without another AI call
             "recommendations": ai_response,
+            "analysis": recommendations.analysis,
+            "changes": recommendations.model_dump(exclude={"analysis"}),
             "skipped_count": len(skipped),
-            "analyzed_count": len(skipped_context)
+            "analyzed_count": analyzed_count
         }
+        
+        if not conversation_history:
+            _last_recommendations["hash"] = prompt_hash
+            _last_recommendations["response"] = result
+        
+        return result
     except Exception as e:
         return {
             "success": False,
@@ -128,10 +273,119 @@ Format your recommendations as actionable items that can be approved and applied
         }
 
 
-def chat_with_ai(user_message: str, conversation_history: List[Dict[str, str]] = None) -> Dict[str, Any]:
+async def stream_recommendations(conversation_history: List[Dict[str, str]] = None) -> AsyncIterator[str]:
+    """Stream recommendation text as it is generated."""
+    skipped = get_skipped_opportunities()
+    if not skipped:
+        yield NO_SKIPPED_MESSAGE
+        return
+    
+    conversation_history = await _trim_history(conversation_history)
+    messages, _ = _build_recommendation_messages(skipped, conversation_history)
+    async for chunk in cached_stream(_get_client(), messages=messages, **RECOMMENDATION_PARAMS):
+        yield chunk
+
+
+async def generate_recommendations_batched(personas: List[str] = None) -> Dict[str, Any]:
     """
-    Continue a conversation with the AI about recommendations.
+    Generate recommendations for several personas in a single AI call.
+    Each persona's skipped posts go in their own prompt section, and the
+    response is a JSON object keyed by persona.
     """
+    if personas is None:
+        personas = list(dynamic_config.get_subreddits().keys())
+    
+    skipped_by_persona = {}
+    for opp in get_skipped_opportunities():
+        persona = opp.get("recommended_persona")
+        if persona in personas:
+            skipped_by_persona.setdefault(persona, []).append(opp)
+    
+    if not skipped_by_persona:
+        return {
+            "success": True,
+            "message": NO_SKIPPED_MESSAGE,
+            "recommendations": {}
+        }
+    
+    sections = []
+    analyzed_counts = {}
+    for persona, skipped in skipped_by_persona.items():
+        skipped_context = _build_skipped_context(skipped)
+        analyzed_counts[persona] = len(skipped_context)
+        skipped_json = orjson.dumps(skipped_context).decode()
+        sections.append(f"### Persona: {persona}\n{skipped_json}")
+    sections_text = "\n\n".join(sections)
+    
+    user_message = f"""Please analyze these skipped posts and their feedback to recommend configuration changes, separately for each persona.
+
+{_config_summary_section()}
+
+## Skipped Posts with Feedback by Persona
+{sections_text}
+
+Respond with a JSON object keyed by persona name. For each persona include:
+- "add_keywords" / "remove_keywords": keywords to add or remove
+- "add_irrelevant_signals": irrelevant signals to add
+- "remove_subreddits": subreddits to remove (if any consistently produce irrelevant results)
+- "analysis": a short explanation of the patterns you noticed for that persona
+
+Leave a list empty if you have no changes of that kind."""
+
+    persona_names = list(skipped_by_persona.keys())
+    recommendations_schema = Recommendations.model_json_schema()
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "RecommendationsByPersona",
+            "schema": {
+                "type": "object",
+                "properties": {persona: recommendations_schema for persona in persona_names},
+                "required": persona_names,
+                "additionalProperties": False
+            },
+            "strict": True
+        }
+    }
+    
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_message}
+    ]
+    
+    try:
+        response = await cached_create(
+            _get_client(),
+            messages=messages,
+            **{**RECOMMENDATION_PARAMS, "max_tokens": 1000 * len(persona_names), "response_format": response_format}
+        )
+        
+        by_persona = orjson.loads(response.choices[0].message.content)
+        
+        results = {}
+        for persona in persona_names:
+            recommendations = Recommendations.model_validate(by_persona[persona])
+            results[persona] = {
+                "recommendations": recommendations.model_dump_json(),
+                "analysis": recommendations.analysis,
+                "changes": recommendations.model_dump(exclude={"analysis"}),
+                "analyzed_count": analyzed_counts[persona]
+            }
+        
+        return {
+            "success": True,
+            "recommendations": results
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "recommendations": None
+        }
+
+
+def _build_chat_messages(user_message: str, conversation_history: List[Dict[str, str]] = None) -> List[Dict[str, str]]:
+    """Build the chat prompt with the current configuration as context."""
     config_summary = dynamic_config.get_config_summary()
     current_config = dynamic_config.load_config()
     
@@ -141,22 +395,29 @@ def chat_with_ai(user_message: str, conversation_history: List[Dict[str, str]] =
 - Subreddits ({config_summary['total_subreddits']}): {', '.join(dynamic_config.get_all_subreddits()[:10])}...
 - Irrelevant signals: {', '.join(current_config['irrelevant_signals'][:10])}..."""
 
+    # The static system prompt goes first and unchanged so OpenAI's prefix cache can reuse it;
+    # the config context changes with every edit, so it follows as its own message
     messages = [
-        {"role": "system", "content": SYSTEM_PROMPT + f"\n\n{context}"}
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": context}
     ]
     
     if conversation_history:
         messages.extend(conversation_history)
     
     messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+async def chat_with_ai(user_message: str, conversation_history: List[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Continue a conversation with the AI about recommendations.
+    """
+    conversation_history = await _trim_history(conversation_history)
+    messages = _build_chat_messages(user_message, conversation_history)
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1500
-        )
+        response = await cached_create(_get_client(), messages=messages, **CHAT_PARAMS)
         
         ai_response = response.choices[0].message.content
         
@@ -171,14 +432,51 @@ def chat_with_ai(user_message: str, conversation_history: List[Dict[str, str]] =
         }
 
 
-def parse_and_apply_changes(changes_text: str) -> Dict[str, Any]:
+async def stream_chat(user_message: str, conversation_history: List[Dict[str, str]] = None) -> AsyncIterator[str]:
+    """Stream the chat reply as it is generated."""
+    conversation_history = await _trim_history(conversation_history)
+    messages = _build_chat_messages(user_message, conversation_history)
+    async for chunk in cached_stream(_get_client(), messages=messages, **CHAT_PARAMS):
+        yield chunk
+
+
+def _parse_changes_locally(changes_text: str) -> Optional[ChangeSet]:
     """
-    Parse AI-suggested changes and apply them to the configuration.
-    Expected format from AI includes structured recommendations.
+    Parse changes that are already JSON: a full ChangeSet (bare or in a code fence),
+    or any JSON object containing at least one of the ChangeSet lists.
     """
-    applied_changes = []
+    try:
+        return ChangeSet.model_validate_json(changes_text)
+    except ValidationError:
+        pass
     
-    # Use AI to parse the changes into structured format
+    match = CODE_FENCE_RE.search(changes_text)
+    if match:
+        try:
+            return ChangeSet.model_validate_json(match.group(1))
+        except ValidationError:
+            pass
+    
+    # Hand-written or pasted JSON may only include some of the lists; missing ones default to empty
+    match = JSON_OBJECT_RE.search(changes_text)
+    if match:
+        try:
+            data = orjson.loads(match.group(0))
+        except orjson.JSONDecodeError:
+            return None
+        if isinstance(data, dict) and not CHANGE_KEYS.isdisjoint(data):
+            try:
+                return ChangeSet.model_validate({key: data.get(key, []) for key in CHANGE_KEYS})
+            except ValidationError:
+                pass
+    return None
+
+
+async def _parse_changes_with_ai(changes_text: str) -> ChangeSet:
+    """
+    Use AI to parse free-form recommendations (e.g. from chat) into structured changes.
+    The reply is validated as a ChangeSet (missing lists default to empty); raises ValidationError otherwise.
+    """
     parse_prompt = f"""Parse the following recommendations into a JSON structure with these arrays:
 - "add_keywords": list of keywords to add
 - "remove_keywords": list of keywords to remove  
@@ -190,51 +488,81 @@ Only include items that are explicitly recommended. Return valid JSON only, no e
 Recommendations:
 {changes_text}"""
 
+    # Exact-match caching only: the parsed changes are applied to the live config, so a
+    # near-identical but different text must never reuse another text's result.
+    # This is a pure text-to-JSON reshape, so the cheaper model is sufficient.
+    response = await cached_create(
+        _get_client(),
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": parse_prompt}],
+        temperature=0,
+        max_tokens=1000
+    )
+    
+    # Parse the JSON response
+    json_str = response.choices[0].message.content
+    
+    # Decode the first JSON object directly, ignoring any prose or fences around it
+    start = json_str.find("{")
+    if start != -1:
+        try:
+            changes, _ = JSON_DECODER.raw_decode(json_str, start)
+            return _validate_changes(changes)
+        except json.JSONDecodeError:
+            pass
+    
+    # Clean up potential markdown formatting
+    if "```json" in json_str:
+        json_str = json_str.split("```json")[1].split("```")[0]
+    elif "```" in json_str:
+        json_str = json_str.split("```")[1].split("```")[0]
+    
+    return _validate_changes(orjson.loads(json_str.strip()))
+
+
+def _validate_changes(changes: Any) -> ChangeSet:
+    """Check AI-parsed changes against the ChangeSet model before they can reach the config."""
+    if not isinstance(changes, dict):
+        return ChangeSet.model_validate(changes)
+    return ChangeSet.model_validate({key: changes.get(key, []) for key in CHANGE_KEYS})
+
+
+async def parse_and_apply_changes(changes_text: str) -> Dict[str, Any]:
+    """
+    Parse AI-suggested changes and apply them to the configuration.
+    Structured output from generate_recommendations is parsed locally;
+    only free-form text falls back to an AI parsing call.
+    """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": parse_prompt}],
-            temperature=0,
-            max_tokens=1000
-        )
+        parsed = _parse_changes_locally(changes_text)
+        if parsed is None:
+            parsed = await _parse_changes_with_ai(changes_text)
+        changes = parsed.model_dump()
         
-        # Parse the JSON response
-        json_str = response.choices[0].message.content
-        # Clean up potential markdown formatting
-        if "```json" in json_str:
-            json_str = json_str.split("```json")[1].split("```")[0]
-        elif "```" in json_str:
-            json_str = json_str.split("```")[1].split("```")[0]
-        
-        changes = json.loads(json_str.strip())
-        
-        # Apply the changes
-        for keyword in changes.get("add_keywords", []):
-            if dynamic_config.add_keyword(keyword):
-                applied_changes.append(f"Added keyword: {keyword}")
-        
-        for keyword in changes.get("remove_keywords", []):
-            if dynamic_config.remove_keyword(keyword):
-                applied_changes.append(f"Removed keyword: {keyword}")
-        
-        for signal in changes.get("add_irrelevant_signals", []):
-            if dynamic_config.add_irrelevant_signal(signal):
-                applied_changes.append(f"Added irrelevant signal: {signal}")
-        
-        for subreddit in changes.get("remove_subreddits", []):
-            if dynamic_config.remove_subreddit(subreddit):
-                applied_changes.append(f"Removed subreddit: {subreddit}")
+        # Apply everything in one config write
+        applied = dynamic_config.apply_changeset(changes)
+        applied_changes = (
+            [f"Added keyword: {keyword}" for keyword in applied["add_keywords"]]
+            + [f"Removed keyword: {keyword}" for keyword in applied["remove_keywords"]]
+            + [f"Added irrelevant signal: {signal}" for signal in applied["add_irrelevant_signals"]]
+            + [f"Removed subreddit: {subreddit}" for subreddit in applied["remove_subreddits"]]
+        )
         
         return {
             "success": True,
             "applied_changes": applied_changes,
             "parsed_changes": changes
         }
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         return {
             "success": False,
             "error": f"Failed to parse AI response as JSON: {str(e)}"
         }
+    except ValidationError as e:
+        return {
+            "success": False,
+            "error": f"AI response is not a valid set of changes: {str(e)}"
+        }
     except Exception as e:
         return {
             "success": False,
@@ -6,24 +6,95 @@ Generates comment suggestions based on the warmeggnog persona style.
 import re
 from config import IQ_RESOURCES, COMPANIES
 
+# Topics in priority order, each with the phrases that indicate it. The first topic
+# with any phrase present wins, regardless of where in the text the phrase appears.
+_TOPIC_TABLE = (
+    ("sql", ("sql",)),
+    ("python", ("python",)),
+    ("machine learning", ("machine learning", "ml ")),
+    ("data science", ("data scientist", "data science")),
+    ("data analyst", ("data analyst", "data analysis")),
+    ("data engineer", ("data engineer",)),
+    ("probability", ("probability", "statistics")),
+    ("coding", ("leetcode", "coding")),
+    ("behavioral", ("behavioral",)),
+    ("job search", ("resume", "job search")),
+    ("company interview", tuple(COMPANIES)),
+)
+
+# One alternation over the whole table; group "t<i>" is the topic at priority i. Wrapped in a
+# lookahead so every position is tested without consuming text, keeping overlapping matches visible.
+_TOPIC_RE = re.compile(
+    "(?=(?:" + "|".join(
+        f"(?P<t{rank}>" + "|".join(map(re.escape, phrases)) + ")"
+        for rank, (_, phrases) in enumerate(_TOPIC_TABLE)
+    ) + "))"
+)
+
+
+# Comment templates, built once at import rather than on every suggestion
+_PERSONA_STYLE = {
+    "tone": "warm, helpful, peer-like",
+    "case": "lowercase casual",
+    "phrases": [
+        "what helped me was",
+        "in my experience",
+        "when i was prepping",
+        "i found it super helpful to",
+        "imo",
+        "ngl",
+        "good luck!",
+    ]
+}
+
+_OPENINGS = {
+    "sql": "sql interviews can definitely be tricky, especially when they throw real-world scenarios at you.",
+    "python": "python interviews often go beyond just syntax - they want to see how you think through problems.",
+    "machine learning": "ml interviews can be intense since they often mix theory with practical implementation.",
+    "data science": "data science interviews usually cover a lot of ground - stats, coding, and business sense.",
+    "data analyst": "data analyst interviews tend to focus heavily on sql and how you communicate insights.",
+    "data engineer": "data engineering interviews often dive deep into system design and data pipelines.",
+    "probability": "probability questions can be tough since they require you to think on your feet.",
+    "coding": "getting back into coding prep can feel overwhelming at first, but it comes back quickly.",
+    "behavioral": "behavioral rounds are often underestimated but they can make or break an offer.",
+    "company interview": "company-specific prep is super important since each has their own style.",
+    "job search": "the job search grind is real, but small optimizations can make a big difference.",
+    "general interview": "interview prep can feel overwhelming, but breaking it down helps a lot.",
+}
+
+_MIDDLES = {
+    "sql": "when i was prepping for data analyst roles, i focused on practicing questions that mimicked real business scenarios rather than just syntax drills. things like window functions, ctes, and joins with edge cases came up a lot.",
+    "python": "what helped me was practicing problems that required me to explain my thought process out loud, not just get the right answer. interviewers care about how you approach problems.",
+    "machine learning": "in my experience, they care less about memorizing algorithms and more about understanding trade-offs and when to use what. being able to explain model choices simply was key.",
+    "data science": "i found it super helpful to practice explaining technical concepts in simple terms - that's often what separates candidates in the final rounds.",
+    "data analyst": "what worked for me was practicing sql with actual datasets and framing my answers around business impact, not just technical correctness.",
+    "data engineer": "when i interviewed for similar roles, system design and understanding data flow end-to-end was heavily tested. knowing your tools deeply helps.",
+    "probability": "imo the best way to prep for probability questions is to practice thinking through them step by step rather than memorizing formulas.",
+    "coding": "when i got back into leetcode after a break, i found it helpful to focus on patterns (sliding window, two pointers, etc.) rather than grinding random problems.",
+    "behavioral": "what helped me was preparing specific stories using the star method and practicing them until they felt natural, not rehearsed.",
+    "company interview": "i made sure to read through interview experiences and company-specific guides before my interviews - knowing what to expect made a huge difference.",
+    "job search": "tailoring my resume for each role and quantifying my impact (percentages, timelines) helped me get past the initial filters.",
+    "general interview": "breaking down prep into categories (technical, behavioral, company research) and tackling them one at a time made it way more manageable.",
+}
+
+_LOW_INTENT_COMMENTS = {
+    "sql": "sql is definitely a foundational skill that opens a lot of doors. practicing with real datasets and focusing on business-oriented questions helps a lot more than just syntax drills imo.",
+    "python": "python's versatility is what makes it so valuable - whether you're doing data analysis, automation, or ml. focusing on practical projects tends to stick better than just tutorials.",
+    "machine learning": "ml is a broad field - i'd recommend picking a specific area (nlp, computer vision, etc.) and going deep rather than trying to learn everything at once.",
+    "data science": "the data science field is definitely evolving. staying current with industry trends while building strong fundamentals in stats and coding is key.",
+    "data analyst": "data analysis is a great entry point into tech. building a portfolio with real projects that show business impact tends to stand out more than certifications.",
+    "data engineer": "data engineering is in high demand right now. getting hands-on with tools like spark, airflow, and cloud platforms is super valuable.",
+    "coding": "consistency beats intensity when it comes to coding practice. even 30 mins a day adds up over time.",
+    "job search": "the job market can be tough but persistence pays off. networking and tailoring applications tends to work better than mass applying.",
+    "general interview": "breaking things down into smaller goals and tracking progress helps keep momentum going. you've got this!",
+}
+
 
 class CommentGenerator:
     """Generate comment suggestions in the warmeggnog persona style."""
     
     def __init__(self):
-        self.persona_style = {
-            "tone": "warm, helpful, peer-like",
-            "case": "lowercase casual",
-            "phrases": [
-                "what helped me was",
-                "in my experience",
-                "when i was prepping",
-                "i found it super helpful to",
-                "imo",
-                "ngl",
-                "good luck!",
-            ]
-        }
+        self.persona_style = _PERSONA_STYLE
     
     def generate_suggestion(self, post_data: dict) -> str:
         """Generate a comment suggestion based on post data."""
@@ -57,30 +128,16 @@ class CommentGenerator:
         """Detect the main topic from text and keywords."""
         combined = f"{text} {keywords}".lower()
         
-        if "sql" in combined:
-            return "sql"
-        elif "python" in combined:
-            return "python"
-        elif "machine learning" in combined or "ml " in combined:
-            return "machine learning"
-        elif "data scientist" in combined or "data science" in combined:
-            return "data science"
-        elif "data analyst" in combined or "data analysis" in combined:
-            return "data analyst"
-        elif "data engineer" in combined:
-            return "data engineer"
-        elif "probability" in combined or "statistics" in combined:
-            return "probability"
-        elif "leetcode" in combined or "coding" in combined:
-            return "coding"
-        elif "behavioral" in combined:
-            return "behavioral"
-        elif "resume" in combined or "job search" in combined:
-            return "job search"
-        elif any(company in combined for company in COMPANIES):
-            return "company interview"
-        else:
-            return "general interview"
+        best = None
+        for match in _TOPIC_RE.finditer(combined):
+            rank = int(match.lastgroup[1:])
+            if best is None or rank < best:
+                best = rank
+                if best == 0:
+                    break
+        if best is not None:
+            return _TOPIC_TABLE[best][0]
+        return "general interview"
     
     def _generate_high_intent_comment(
         self, topic: str, companies: str, resource: str, links_allowed: bool, text: str
@@ -88,40 +145,10 @@ class CommentGenerator:
         """Generate comment for high-intent posts (interview prep, questions, etc.)."""
         
         # Opening - acknowledge their situation
-        openings = {
-            "sql": "sql interviews can definitely be tricky, especially when they throw real-world scenarios at you.",
-            "python": "python interviews often go beyond just syntax - they want to see how you think through problems.",
-            "machine learning": "ml interviews can be intense since they often mix theory with practical implementation.",
-            "data science": "data science interviews usually cover a lot of ground - stats, coding, and business sense.",
-            "data analyst": "data analyst interviews tend to focus heavily on sql and how you communicate insights.",
-            "data engineer": "data engineering interviews often dive deep into system design and data pipelines.",
-            "probability": "probability questions can be tough since they require you to think on your feet.",
-            "coding": "getting back into coding prep can feel overwhelming at first, but it comes back quickly.",
-            "behavioral": "behavioral rounds are often underestimated but they can make or break an offer.",
-            "company interview": "company-specific prep is super important since each has their own style.",
-            "job search": "the job search grind is real, but small optimizations can make a big difference.",
-            "general interview": "interview prep can feel overwhelming, but breaking it down helps a lot.",
-        }
-        
-        opening = openings.get(topic, openings["general interview"])
+        opening = _OPENINGS.get(topic, _OPENINGS["general interview"])
         
         # Middle - share personal experience/advice
-        middles = {
-            "sql": "when i was prepping for data analyst roles, i focused on practicing questions that mimicked real business scenarios rather than just syntax drills. things like window functions, ctes, and joins with edge cases came up a lot.",
-            "python": "what helped me was practicing problems that required me to explain my thought process out loud, not just get the right answer. interviewers care about how you approach problems.",
-            "machine learning": "in my experience, they care less about memorizing algorithms and more about understanding trade-offs and when to use what. being able to explain model choices simply was key.",
-            "data science": "i found it super helpful to practice explaining technical concepts in simple terms - that's often what separates candidates in the final rounds.",
-            "data analyst": "what worked for me was practicing sql with actual datasets and framing my answers around business impact, not just technical correctness.",
-            "data engineer": "when i interviewed for similar roles, system design and understanding data flow end-to-end was heavily tested. knowing your tools deeply helps.",
-            "probability": "imo the best way to prep for probability questions is to practice thinking through them step by step rather than memorizing formulas.",
-            "coding": "when i got back into leetcode after a break, i found it helpful to focus on patterns (sliding window, two pointers, etc.) rather than grinding random problems.",
-            "behavioral": "what helped me was preparing specific stories using the star method and practicing them until they felt natural, not rehearsed.",
-            "company interview": "i made sure to read through interview experiences and company-specific guides before my interviews - knowing what to expect made a huge difference.",
-            "job search": "tailoring my resume for each role and quantifying my impact (percentages, timelines) helped me get past the initial filters.",
-            "general interview": "breaking down prep into categories (technical, behavioral, company research) and tackling them one at a time made it way more manageable.",
-        }
-        
-        middle = middles.get(topic, middles["general interview"])
+        middle = _MIDDLES.get(topic, _MIDDLES["general interview"])
         
         # Closing - optional resource mention
         if links_allowed and resource:
@@ -135,20 +162,7 @@ class CommentGenerator:
     
     def _generate_low_intent_comment(self, topic: str, text: str) -> str:
         """Generate comment for low-intent posts (general career advice, etc.)."""
-        
-        comments = {
-            "sql": "sql is definitely a foundational skill that opens a lot of doors. practicing with real datasets and focusing on business-oriented questions helps a lot more than just syntax drills imo.",
-            "python": "python's versatility is what makes it so valuable - whether you're doing data analysis, automation, or ml. focusing on practical projects tends to stick better than just tutorials.",
-            "machine learning": "ml is a broad field - i'd recommend picking a specific area (nlp, computer vision, etc.) and going deep rather than trying to learn everything at once.",
-            "data science": "the data science field is definitely evolving. staying current with industry trends while building strong fundamentals in stats and coding is key.",
-            "data analyst": "data analysis is a great entry point into tech. building a portfolio with real projects that show business impact tends to stand out more than certifications.",
-            "data engineer": "data engineering is in high demand right now. getting hands-on with tools like spark, airflow, and cloud platforms is super valuable.",
-            "coding": "consistency beats intensity when it comes to coding practice. even 30 mins a day adds up over time.",
-            "job search": "the job market can be tough but persistence pays off. networking and tailoring applications tends to work better than mass applying.",
-            "general interview": "breaking things down into smaller goals and tracking progress helps keep momentum going. you've got this!",
-        }
-        
-        return comments.get(topic, comments["general interview"])
+        return _LOW_INTENT_COMMENTS.get(topic, _LOW_INTENT_COMMENTS["general interview"])
 
 
 if __name__ == "__main__":
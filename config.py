@@ -209,8 +209,8 @@ SUBREDDITS = {
     ],
 }
 
-# All unique subreddits (flattened)
-ALL_SUBREDDITS = list(set(
+# All unique subreddits (flattened, in declaration order so the list is stable across runs)
+ALL_SUBREDDITS = list(dict.fromkeys(
     sub for subs in SUBREDDITS.values() for sub in subs
 ))
 
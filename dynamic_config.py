@@ -3,25 +3,60 @@ Dynamic Configuration Manager
 Loads and saves scanner configuration from JSON file for runtime updates.
 """
 
-import json
+import copy
 import os
-from typing import Dict, List, Any
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain
+from types import MappingProxyType
+from typing import Dict, List, Any, Mapping
+
+import orjson
+
 
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), "scanner_config.json")
 
+# Parsed config shared by all getters, keyed by the file's mtime so external edits are picked up
+_config_cache = {"mtime": None, "data": None}
+
+
+def _config_mtime():
+    """Modification time of the config file in nanoseconds, or None if it doesn't exist."""
+    try:
+        return os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
 
 def load_config() -> Dict[str, Any]:
-    """Load configuration from JSON file."""
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    return get_default_config()
+    """Load configuration from JSON file, re-parsing only when the file has changed."""
+    mtime = _config_mtime()
+    if _config_cache["data"] is not None and mtime == _config_cache["mtime"]:
+        return _config_cache["data"]
+    
+    if mtime is not None:
+        with open(CONFIG_FILE, "rb") as f:
+            config = orjson.loads(f.read())
+    else:
+        config = get_default_config()
+    
+    _config_cache["mtime"] = mtime
+    _config_cache["data"] = config
+    return config
 
 
 def save_config(config: Dict[str, Any]) -> None:
-    """Save configuration to JSON file."""
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=2)
+    """Save configuration to JSON file atomically, so a failed write never leaves a partial file."""
+    tmp_file = CONFIG_FILE + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(orjson.dumps(config, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_file, CONFIG_FILE)
+    # Cache what we just wrote so the next load doesn't re-read it
+    _config_cache["mtime"] = _config_mtime()
+    _config_cache["data"] = config
+    _all_subreddits_for.cache_clear()
+    _subreddit_personas_for.cache_clear()
+    _summary_for.cache_clear()
 
 
 def get_default_config() -> Dict[str, Any]:
@@ -59,10 +94,35 @@ def get_subreddits() -> Dict[str, List[str]]:
     return load_config().get("subreddits", {})
 
 
+@lru_cache(maxsize=32)
+def _all_subreddits_for(mtime) -> tuple:
+    """Flattened unique subreddits for the config at the given mtime."""
+    # dict.fromkeys over chain dedups in C like a set union, but keeps config order stable
+    # across restarts so the scan rotation index keeps pointing at the same subreddits
+    return tuple(dict.fromkeys(chain.from_iterable(get_subreddits().values())))
+
+
 def get_all_subreddits() -> List[str]:
     """Get flattened list of all unique subreddits."""
-    subreddits = get_subreddits()
-    return list(set(sub for subs in subreddits.values() for sub in subs))
+    load_config()
+    return list(_all_subreddits_for(_config_cache["mtime"]))
+
+
+@lru_cache(maxsize=32)
+def _subreddit_personas_for(mtime) -> Dict[str, str]:
+    """Lowercased subreddit -> persona for the config at the given mtime."""
+    personas = {}
+    for persona, subs in get_subreddits().items():
+        for sub in subs:
+            # First persona listing a subreddit wins
+            personas.setdefault(sub.lower(), persona)
+    return personas
+
+
+def get_subreddit_personas() -> Mapping[str, str]:
+    """Get a read-only lowercased subreddit -> persona lookup."""
+    load_config()
+    return MappingProxyType(_subreddit_personas_for(_config_cache["mtime"]))
 
 
 def get_companies() -> List[str]:
@@ -92,77 +152,120 @@ def get_subreddits_per_scan() -> int:
 
 # Config update functions for AI recommendations
 
+@contextmanager
+def mutate_config():
+    """
+    Load the config once, yield a copy to modify and save it once on exit if it changed.
+    Nothing is saved if the block raises.
+    """
+    config = copy.deepcopy(load_config())
+    yield config
+    if config != load_config():
+        save_config(config)
+
+
+def _add_unique(items: List[str], value: str) -> bool:
+    """Append value unless it is already present (case-insensitive)."""
+    value_lower = value.lower()
+    if any(item.lower() == value_lower for item in items):
+        return False
+    items.append(value)
+    return True
+
+
+def _remove_keyword(config: Dict[str, Any], keyword: str) -> bool:
+    """Remove a keyword (case-insensitive) from a loaded config."""
+    keyword_lower = keyword.lower()
+    idx = next((i for i, k in enumerate(config["keywords"]) if k.lower() == keyword_lower), None)
+    if idx is None:
+        return False
+    config["keywords"].pop(idx)
+    return True
+
+
+def _remove_subreddit(config: Dict[str, Any], subreddit: str) -> bool:
+    """Remove a subreddit from every persona in a loaded config."""
+    removed = False
+    for persona in config["subreddits"]:
+        if subreddit in config["subreddits"][persona]:
+            config["subreddits"][persona].remove(subreddit)
+            removed = True
+    return removed
+
+
 def add_keyword(keyword: str) -> bool:
     """Add a new keyword to the list."""
-    config = load_config()
-    if keyword.lower() not in [k.lower() for k in config["keywords"]]:
-        config["keywords"].append(keyword)
-        save_config(config)
-        return True
-    return False
+    with mutate_config() as config:
+        return _add_unique(config["keywords"], keyword)
 
 
 def remove_keyword(keyword: str) -> bool:
     """Remove a keyword from the list."""
-    config = load_config()
-    keywords_lower = [k.lower() for k in config["keywords"]]
-    if keyword.lower() in keywords_lower:
-        idx = keywords_lower.index(keyword.lower())
-        config["keywords"].pop(idx)
-        save_config(config)
-        return True
-    return False
+    with mutate_config() as config:
+        return _remove_keyword(config, keyword)
 
 
 def add_subreddit(subreddit: str, persona: str = "warmeggnog") -> bool:
     """Add a new subreddit to a persona's list."""
-    config = load_config()
-    if persona not in config["subreddits"]:
-        config["subreddits"][persona] = []
-    if subreddit not in config["subreddits"][persona]:
-        config["subreddits"][persona].append(subreddit)
-        save_config(config)
+    with mutate_config() as config:
+        subs = config["subreddits"].setdefault(persona, [])
+        if subreddit in subs:
+            return False
+        subs.append(subreddit)
         return True
-    return False
 
 
 def remove_subreddit(subreddit: str) -> bool:
     """Remove a subreddit from all personas."""
-    config = load_config()
-    removed = False
-    for persona in config["subreddits"]:
-        if subreddit in config["subreddits"][persona]:
-            config["subreddits"][persona].remove(subreddit)
-            removed = True
-    if removed:
-        save_config(config)
-    return removed
+    with mutate_config() as config:
+        return _remove_subreddit(config, subreddit)
 
 
 def add_irrelevant_signal(signal: str) -> bool:
     """Add a new irrelevant signal."""
-    config = load_config()
-    if signal.lower() not in [s.lower() for s in config["irrelevant_signals"]]:
-        config["irrelevant_signals"].append(signal)
-        save_config(config)
-        return True
-    return False
+    with mutate_config() as config:
+        return _add_unique(config["irrelevant_signals"], signal)
 
 
 def add_relevant_signal(signal: str) -> bool:
     """Add a new relevant signal."""
+    with mutate_config() as config:
+        return _add_unique(config["relevant_signals"], signal)
+
+
+def apply_changeset(changes: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """
+    Apply a batch of AI-recommended changes with one read and one atomic write.
+    Accepts add_keywords, remove_keywords, add_irrelevant_signals and remove_subreddits,
+    and returns the changes that actually took effect under the same keys.
+    """
+    applied = {"add_keywords": [], "remove_keywords": [], "add_irrelevant_signals": [], "remove_subreddits": []}
+    
+    with mutate_config() as config:
+        for keyword in changes.get("add_keywords", []):
+            if _add_unique(config["keywords"], keyword):
+                applied["add_keywords"].append(keyword)
+        
+        for keyword in changes.get("remove_keywords", []):
+            if _remove_keyword(config, keyword):
+                applied["remove_keywords"].append(keyword)
+        
+        for signal in changes.get("add_irrelevant_signals", []):
+            if _add_unique(config["irrelevant_signals"], signal):
+                applied["add_irrelevant_signals"].append(signal)
+        
+        for subreddit in changes.get("remove_subreddits", []):
+            if _remove_subreddit(config, subreddit):
+                applied["remove_subreddits"].append(subreddit)
+    
+    return applied
+
+
+@lru_cache(maxsize=32)
+def _summary_for(mtime) -> Dict[str, Any]:
+    """Config summary for the config at the given mtime."""
     config = load_config()
-    if signal.lower() not in [s.lower() for s in config["relevant_signals"]]:
-        config["relevant_signals"].append(signal)
-        save_config(config)
-        return True
-    return False
-
-
-def get_config_summary() -> Dict[str, Any]:
-    """Get a summary of current configuration for AI context."""
-    config = load_config()
-    all_subs = get_all_subreddits()
+    all_subs = _all_subreddits_for(mtime)
     return {
         "total_keywords": len(config.get("keywords", [])),
         "total_subreddits": len(all_subs),
@@ -172,3 +275,10 @@ def get_config_summary() -> Dict[str, Any]:
         "max_post_age_hours": config.get("max_post_age_hours", 48),
         "posts_per_subreddit": config.get("posts_per_subreddit", 25)
     }
+
+
+def get_config_summary() -> Dict[str, Any]:
+    """Get a summary of current configuration for AI context."""
+    load_config()
+    summary = _summary_for(_config_cache["mtime"])
+    return {**summary, "personas": list(summary["personas"])}
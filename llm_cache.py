@@ -0,0 +1,230 @@
+"""
+LLM Response Cache
+Two-tier cache in front of async OpenAI chat completions:
+- L1 exact-match: SHA-256 over the normalized request, stored in SQLite with LRU + TTL eviction.
+- L2 semantic: embedding similarity on the final user message, for prompts that paraphrase.
+"""
+
+import os
+import json
+import asyncio
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import Dict, List, Any, Optional, AsyncIterator
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+
+CACHE_FILE = os.path.join(os.path.dirname(__file__), "llm_cache.db")
+CACHE_TTL_SECONDS = 24 * 3600
+CACHE_MAX_ENTRIES = 1000
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_MAX_ENTRIES = 500
+
+# Only these request fields affect the completion; anything else (timeouts, user, etc.) is left out of the key
+KEY_FIELDS = ("model", "messages", "temperature", "max_tokens", "top_p", "response_format", "stop", "seed")
+
+# Bounds concurrent OpenAI requests to stay within rate limits
+MAX_CONCURRENT_REQUESTS = 5
+api_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+_db = None
+_db_lock = threading.Lock()
+
+# Semantic index: context key -> list of {"vector", "response"}
+_semantic_index: Dict[str, List[Dict[str, Any]]] = {}
+_semantic_lock = threading.Lock()
+
+
+def _normalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """NFC-normalize message content and lowercase roles."""
+    normalized = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            content = unicodedata.normalize("NFC", content)
+        normalized.append({**message, "role": str(message.get("role", "")).lower(), "content": content})
+    return normalized
+
+
+def _hash_request(params: Dict[str, Any]) -> str:
+    """SHA-256 of the canonical JSON blob for the output-affecting request fields."""
+    canonical = {k: params[k] for k in KEY_FIELDS if params.get(k) is not None}
+    canonical["model"] = str(canonical.get("model", "")).lower()
+    canonical["messages"] = _normalize_messages(canonical.get("messages", []))
+    blob = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _get_db() -> sqlite3.Connection:
+    """Get or create the SQLite connection backing the exact-match cache."""
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+        _db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        _db.commit()
+    return _db
+
+
+def get_exact(key: str) -> Optional[str]:
+    """Return the cached response JSON for a key, or None if missing/expired."""
+    now = time.time()
+    with _db_lock:
+        db = _get_db()
+        row = db.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > CACHE_TTL_SECONDS:
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            db.commit()
+            return None
+        db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        db.commit()
+        return row[0]
+
+
+def set_exact(key: str, response_json: str) -> None:
+    """Store a response and evict least-recently-used entries past the size limit."""
+    now = time.time()
+    with _db_lock:
+        db = _get_db()
+        db.execute(
+            "INSERT OR REPLACE INTO responses (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+            (key, response_json, now, now)
+        )
+        db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (CACHE_MAX_ENTRIES,)
+        )
+        db.commit()
+
+
+async def _embed(client, text: str) -> List[float]:
+    """Embed text and return a unit-length vector so cosine similarity is a dot product."""
+    async with api_semaphore:
+        response = await client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+    vector = response.data[0].embedding
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def _get_semantic(context_key: str, vector: List[float], threshold: float) -> Optional[str]:
+    """Return the most similar cached response above the threshold, if any."""
+    best_score, best_response = threshold, None
+    with _semantic_lock:
+        entries = list(_semantic_index.get(context_key, []))
+    for entry in entries:
+        score = sum(a * b for a, b in zip(vector, entry["vector"]))
+        if score >= best_score:
+            best_score, best_response = score, entry["response"]
+    return best_response
+
+
+def _set_semantic(context_key: str, vector: List[float], response_json: str) -> None:
+    """Add a response to the semantic index, dropping the oldest entries past the size limit."""
+    with _semantic_lock:
+        entries = _semantic_index.setdefault(context_key, [])
+        entries.append({"vector": vector, "response": response_json})
+        if len(entries) > SEMANTIC_MAX_ENTRIES:
+            del entries[:len(entries) - SEMANTIC_MAX_ENTRIES]
+
+
+async def _lookup(client, params: Dict[str, Any], semantic_threshold: Optional[float], refresh: bool = False) -> Dict[str, Any]:
+    """
+    Check both cache tiers. Returns the hit (if any) plus the keys needed to store a miss.
+    With refresh=True nothing is read, but the keys are still computed so the fresh response is stored.
+    The SQLite read and the similarity scan are blocking, so they run in a worker thread.
+    """
+    lookup = {"hit": None, "key": _hash_request(params), "context_key": None, "vector": None}
+    if not refresh:
+        lookup["hit"] = await asyncio.to_thread(get_exact, lookup["key"])
+    if lookup["hit"] is not None:
+        return lookup
+
+    # Semantic matches are only considered for deterministic (temperature 0) requests, and only
+    # within the same context (everything except the last message)
+    messages = params.get("messages", [])
+    if (semantic_threshold is None or params.get("temperature") != 0
+            or not messages or not isinstance(messages[-1].get("content"), str)):
+        return lookup
+    try:
+        vector = await _embed(client, unicodedata.normalize("NFC", messages[-1]["content"]))
+    except Exception as e:
+        # The semantic tier is an optimization; an embeddings failure is just a miss
+        print(f"Embedding failed, skipping semantic cache: {e}")
+        return lookup
+    lookup["context_key"] = _hash_request({**params, "messages": messages[:-1]})
+    lookup["vector"] = vector
+    if not refresh:
+        lookup["hit"] = await asyncio.to_thread(_get_semantic, lookup["context_key"], lookup["vector"], semantic_threshold)
+    return lookup
+
+
+def _store(lookup: Dict[str, Any], response_json: str) -> None:
+    """Store a fresh response in both cache tiers (blocking; callers run it in a worker thread)."""
+    set_exact(lookup["key"], response_json)
+    if lookup["vector"] is not None:
+        _set_semantic(lookup["context_key"], lookup["vector"], response_json)
+
+
+async def cached_create(client, semantic_threshold: Optional[float] = None, refresh: bool = False, **params) -> ChatCompletion:
+    """
+    Drop-in replacement for await client.chat.completions.create(**params) with caching.
+    Pass semantic_threshold to also match paraphrased final user messages (cosine similarity) on
+    temperature-0 requests, or refresh=True to bypass cached responses and store a fresh one.
+    """
+    lookup = await _lookup(client, params, semantic_threshold, refresh)
+    if lookup["hit"] is not None:
+        return ChatCompletion.model_validate_json(lookup["hit"])
+
+    async with api_semaphore:
+        response = await client.chat.completions.create(**params)
+    await asyncio.to_thread(_store, lookup, response.model_dump_json())
+    return response
+
+
+async def cached_stream(client, semantic_threshold: Optional[float] = None, **params) -> AsyncIterator[str]:
+    """
+    Streaming variant of cached_create that yields content deltas as they arrive.
+    A cache hit yields the full content at once; a miss is buffered and cached when the stream ends.
+    """
+    lookup = await _lookup(client, params, semantic_threshold)
+    if lookup["hit"] is not None:
+        yield ChatCompletion.model_validate_json(lookup["hit"]).choices[0].message.content or ""
+        return
+
+    buffer = []
+    last_chunk = None
+    finish_reason = None
+    async with api_semaphore:
+        async for chunk in await client.chat.completions.create(stream=True, **params):
+            last_chunk = chunk
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta.content or ""
+            if delta:
+                buffer.append(delta)
+                yield delta
+
+    # Only completed streams are cached; a truncated reply should not be replayed
+    if last_chunk is not None and finish_reason == "stop":
+        response = ChatCompletion(
+            id=last_chunk.id,
+            object="chat.completion",
+            created=last_chunk.created,
+            model=last_chunk.model,
+            choices=[Choice(
+                index=0,
+                finish_reason=finish_reason,
+                message=ChatCompletionMessage(role="assistant", content="".join(buffer))
+            )]
+        )
+        await asyncio.to_thread(_store, lookup, response.model_dump_json())
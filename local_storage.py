@@ -1,167 +1,355 @@
 """
 Local JSON storage for opportunities - avoids Google Sheets rate limits
+Opportunities are kept in memory and persisted as an append-only JSONL log.
 """
 
-import json
+import mmap
 import os
+import pickle
+import threading
 from datetime import datetime
-import hashlib
+from typing import Any, Dict, List, Optional, Set, Tuple
 
-DATA_FILE = os.path.join(os.path.dirname(__file__), "opportunities.json")
-SCAN_STATE_FILE = os.path.join(os.path.dirname(__file__), "scan_state.json")
+import orjson
+import xxhash
 
+DATA_FILE = os.path.join(os.path.dirname(__file__), "opportunities.jsonl")
+LEGACY_DATA_FILE = os.path.join(os.path.dirname(__file__), "opportunities.json")
+SCAN_STATE_FILE = os.path.join(os.path.dirname(__file__), "scan_state.pkl")
+LEGACY_SCAN_STATE_FILE = os.path.join(os.path.dirname(__file__), "scan_state.json")
+SUBREDDIT_RULES_FILE = os.path.join(os.path.dirname(__file__), "subreddit_rules.json")
 
-def _load_data():
-    """Load data from JSON file."""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as f:
-            return json.load(f)
-    return {"opportunities": []}
+# Rewrite the log once this many update records have accumulated
+COMPACT_THRESHOLD = 500
 
+# Opportunities by id, in insertion order. Loaded once from the append-only log in DATA_FILE,
+# where each line is either an opportunity or an {"op": "update"} record for an earlier one.
+_index: Optional[Dict[str, Dict[str, Any]]] = None
+_urls: Set[str] = set()
+# Ids of opportunities with a reply URL, as an insertion-ordered set
+_reply_ids: Dict[str, None] = {}
+_pending_updates: int = 0
 
-def _save_data(data):
-    """Save data to JSON file."""
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+# Scan rotation state, loaded once. Rotation advances are written behind (see flush_scan_state)
+_scan_state: Optional[Dict[str, Any]] = None
+_scan_state_dirty: bool = False
 
+# Storage calls are made from worker threads, so the index, the log and the scan state are only
+# touched under this lock. Reentrant because compaction and updates reload the index.
+_lock = threading.RLock()
 
-def generate_id(url: str) -> str:
-    """Generate unique ID from URL."""
-    return hashlib.md5(url.encode()).hexdigest()[:12]
+# Subreddit scans run in worker threads, so rules-file rewrites are serialized
+_rules_lock = threading.Lock()
 
 
-def get_all_opportunities():
-    """Get all opportunities."""
-    data = _load_data()
-    return data.get("opportunities", [])
+def _dumps_line(obj: Dict[str, Any]) -> bytes:
+    """Serialize a record as a single JSONL line."""
+    return orjson.dumps(obj) + b"\n"
 
 
-def get_existing_urls():
-    """Get set of existing URLs to avoid duplicates."""
-    opportunities = get_all_opportunities()
-    return {o.get("url") for o in opportunities}
+def _write_atomic(path: str, data: bytes) -> None:
+    """Write a file via a temp file and rename, so a crash never leaves it half-written."""
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
 
 
-def append_opportunities(new_opportunities: list):
-    """Add new opportunities."""
-    data = _load_data()
-    
-    for opp in new_opportunities:
-        opp["id"] = generate_id(opp["url"])
-        opp["scan_time"] = datetime.now().isoformat()
-        if "status" not in opp:
-            opp["status"] = "pending"
-        if "reply_url" not in opp:
-            opp["reply_url"] = ""
-        data["opportunities"].append(opp)
-    
-    _save_data(data)
+def _apply_record(index: Dict[str, Dict[str, Any]], record: Dict[str, Any]) -> None:
+    """Apply one log record to the in-memory index."""
+    if record.get("op") == "update":
+        opp = index.get(record["id"])
+        if opp is not None:
+            opp.update(record["fields"])
+    else:
+        index[record["id"]] = record
 
 
-def update_opportunity_status(opportunity_id: str, status: str):
-    """Update status of an opportunity."""
-    data = _load_data()
+def _load_index() -> Dict[str, Dict[str, Any]]:
+    """Load the opportunity index, replaying the log on first use."""
+    global _index, _urls, _reply_ids, _pending_updates
+    if _index is not None:
+        return _index
     
-    for opp in data["opportunities"]:
-        if opp.get("id") == opportunity_id:
-            opp["status"] = status
-            break
+    with _lock:
+        if _index is not None:
+            return _index
+        
+        # Built locally and published last, so no caller ever sees a partly replayed index
+        index = {}
+        pending_updates = 0
+        migrated = False
+        if os.path.exists(DATA_FILE):
+            pending_updates = _replay_log(index)
+        elif os.path.exists(LEGACY_DATA_FILE):
+            # One-time migration from the old single-document JSON file
+            with open(LEGACY_DATA_FILE, "rb") as f:
+                for opp in orjson.loads(f.read()).get("opportunities", []):
+                    index[opp["id"]] = opp
+            migrated = True
+        _urls = {o.get("url") for o in index.values()}
+        _reply_ids = dict.fromkeys(o["id"] for o in index.values() if o.get("reply_url"))
+        _pending_updates = pending_updates
+        _index = index
+        if migrated:
+            compact()
+        return _index
+
+
+def _replay_log(index: Dict[str, Dict[str, Any]]) -> int:
+    """
+    Apply every record in the log to index and return how many were updates.
+    A final line left torn by a crash mid-append is dropped and truncated off the file.
+    """
+    pending_updates = 0
+    good_end = 0
+    torn = False
+    # Memory-map the log so replay reads lines straight from the page cache
+    with open(DATA_FILE, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                # Only the last line can be torn; a bad line anywhere else is real corruption
+                if not line.endswith(b"\n"):
+                    torn = True
+                    break
+                if line.strip():
+                    try:
+                        record = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        if mm.tell() < size:
+                            raise
+                        torn = True
+                        break
+                    _apply_record(index, record)
+                    if record.get("op") == "update":
+                        pending_updates += 1
+                good_end = mm.tell()
     
-    _save_data(data)
+    if torn:
+        print(f"Dropping torn last line of {DATA_FILE} ({size - good_end} bytes)")
+        os.truncate(DATA_FILE, good_end)
+    return pending_updates
+
+
+def _append_records(records: List[Dict[str, Any]]) -> None:
+    """Append records to the log and fsync, since the log is the only copy of the data."""
+    with open(DATA_FILE, "ab") as f:
+        f.write(b"".join(_dumps_line(record) for record in records))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _update_opportunity(opportunity_id: str, fields: Dict[str, Any]) -> None:
+    """Update fields of one opportunity in memory and append the change to the log."""
+    global _pending_updates
+    with _lock:
+        opp = _load_index().get(opportunity_id)
+        if opp is None:
+            return
+        
+        opp.update(fields)
+        _append_records([{"op": "update", "id": opportunity_id, "fields": fields}])
+        _pending_updates += 1
+        if _pending_updates >= COMPACT_THRESHOLD:
+            compact()
+
+
+def compact() -> None:
+    """Rewrite the log as one line per opportunity, dropping applied update records."""
+    global _pending_updates
+    with _lock:
+        index = _load_index()
+        _write_atomic(DATA_FILE, b"".join(_dumps_line(opp) for opp in index.values()))
+        _pending_updates = 0
 
 
-def save_reply_url(opportunity_id: str, reply_url: str):
-    """Save reply URL and mark as replied."""
-    data = _load_data()
-    
-    for opp in data["opportunities"]:
-        if opp.get("id") == opportunity_id:
-            opp["reply_url"] = reply_url
-            opp["status"] = "replied"
-            opp["reply_timestamp"] = datetime.now().isoformat()
-            break
-    
-    _save_data(data)
+def generate_id(url: str) -> str:
+    """Generate unique ID from URL."""
+    # Non-cryptographic dedup key; xxh3 is much faster than md5. Always xxh3, since ids are persisted.
+    return xxhash.xxh3_64_hexdigest(url.encode())[:12]
 
 
-def get_tracked_replies():
-    """Get opportunities that have been replied to."""
-    opportunities = get_all_opportunities()
-    return [o for o in opportunities if o.get("reply_url")]
+def get_all_opportunities() -> List[Dict[str, Any]]:
+    """Get all opportunities."""
+    # Copies, so callers decorating results (e.g. with live scores) don't alter stored records
+    with _lock:
+        return [dict(opp) for opp in _load_index().values()]
 
 
-def save_feedback(opportunity_id: str, feedback: str):
-    """Save feedback for an opportunity."""
-    data = _load_data()
-    
-    for opp in data["opportunities"]:
-        if opp.get("id") == opportunity_id:
-            opp["feedback"] = feedback
-            opp["status"] = "skipped"
-            break
+def get_opportunity(opportunity_id: str) -> Optional[Dict[str, Any]]:
+    """Get a single opportunity by id, or None if it doesn't exist."""
+    with _lock:
+        opp = _load_index().get(opportunity_id)
+        return dict(opp) if opp is not None else None
+
+
+def append_opportunities(new_opportunities: List[Dict[str, Any]]) -> int:
+    """Add new opportunities, skipping URLs already stored. Returns the number inserted."""
+    if not new_opportunities:
+        return 0
+    # All opportunities in a batch share one scan time
+    scan_time = datetime.now().isoformat()
     
-    _save_data(data)
+    with _lock:
+        index = _load_index()
+        inserted = []
+        for opp in new_opportunities:
+            if opp["url"] in _urls:
+                continue
+            inserted.append(opp)
+            opp["id"] = generate_id(opp["url"])
+            opp["scan_time"] = scan_time
+            opp.setdefault("status", "pending")
+            opp.setdefault("reply_url", "")
+            index[opp["id"]] = dict(opp)
+            _urls.add(opp["url"])
+            if opp["reply_url"]:
+                _reply_ids[opp["id"]] = None
+        
+        if inserted:
+            _append_records(inserted)
+    return len(inserted)
+
+
+def update_opportunity_status(opportunity_id: str, status: str) -> None:
+    """Update status of an opportunity."""
+    _update_opportunity(opportunity_id, {"status": status})
 
 
-def _load_scan_state():
-    """Load scan state from JSON file."""
-    if os.path.exists(SCAN_STATE_FILE):
-        with open(SCAN_STATE_FILE, "r") as f:
-            return json.load(f)
-    return {"next_index": 0, "scanned_subreddits": []}
+def save_reply_url(opportunity_id: str, reply_url: str) -> None:
+    """Save reply URL and mark as replied."""
+    with _lock:
+        _update_opportunity(opportunity_id, {
+            "reply_url": reply_url,
+            "status": "replied",
+            "reply_timestamp": datetime.now().isoformat()
+        })
+        if reply_url and opportunity_id in _index:
+            _reply_ids[opportunity_id] = None
 
 
-def reset_scan_state():
+def get_tracked_replies() -> List[Dict[str, Any]]:
+    """Get opportunities that have been replied to."""
+    with _lock:
+        index = _load_index()
+        return [dict(index[i]) for i in _reply_ids]
+
+
+def save_feedback(opportunity_id: str, feedback: str) -> None:
+    """Save feedback for an opportunity."""
+    _update_opportunity(opportunity_id, {
+        "feedback": feedback,
+        "status": "skipped"
+    })
+
+
+def _load_scan_state() -> Dict[str, Any]:
+    """Load scan state, reading the pickle file only on first use."""
+    global _scan_state
+    with _lock:
+        if _scan_state is not None:
+            return _scan_state
+        
+        if os.path.exists(SCAN_STATE_FILE):
+            with open(SCAN_STATE_FILE, "rb") as f:
+                _scan_state = pickle.load(f)
+        elif os.path.exists(LEGACY_SCAN_STATE_FILE):
+            with open(LEGACY_SCAN_STATE_FILE, "rb") as f:
+                _scan_state = orjson.loads(f.read())
+        else:
+            _scan_state = {"next_index": 0, "scanned_subreddits": []}
+        return _scan_state
+
+
+def reset_scan_state() -> Dict[str, Any]:
     """Reset scan state to start fresh."""
     state = {"next_index": 0, "scanned_subreddits": []}
     _save_scan_state(state)
     return state
 
 
-def _save_scan_state(state):
-    """Save scan state to JSON file."""
-    with open(SCAN_STATE_FILE, "w") as f:
-        json.dump(state, f, indent=2)
+def _save_scan_state(state: Dict[str, Any]) -> None:
+    """Save scan state to the pickle file and keep it as the in-memory copy."""
+    global _scan_state, _scan_state_dirty
+    with _lock:
+        _scan_state = state
+        _write_atomic(SCAN_STATE_FILE, pickle.dumps(state, protocol=5))
+        _scan_state_dirty = False
 
 
-def get_current_batch_number(total_subreddits: int, batch_size: int = 3) -> int:
-    """Get the current batch number (1-indexed) based on scan state."""
-    state = _load_scan_state()
-    next_index = state.get("next_index", 0)
-    
-    # Calculate which batch we just completed
+def flush_scan_state() -> None:
+    """Write a rotation advanced in memory back to disk; call once per scan cycle."""
+    with _lock:
+        if _scan_state_dirty:
+            _save_scan_state(_scan_state)
+
+
+def _batch_number(next_index: int, total_subreddits: int, batch_size: int) -> int:
+    """Batch number (1-indexed) of the batch that ended just before next_index."""
     if next_index == 0:
         # We just wrapped around, so we completed the last batch
-        total_batches = (total_subreddits + batch_size - 1) // batch_size
-        return total_batches
-    else:
-        # Current batch is based on next_index
-        return (next_index + batch_size - 1) // batch_size
+        return (total_subreddits + batch_size - 1) // batch_size
+    # Current batch is based on next_index
+    return (next_index + batch_size - 1) // batch_size
 
 
-def get_next_subreddits(all_subreddits: list, batch_size: int = 3) -> list:
-    """Get next batch of subreddits to scan, rotating through the list."""
+def get_current_batch_number(total_subreddits: int, batch_size: int = 3) -> int:
+    """Get the current batch number (1-indexed) based on scan state."""
     state = _load_scan_state()
-    next_index = state.get("next_index", 0)
+    return _batch_number(state.get("next_index", 0), total_subreddits, batch_size)
+
+
+def get_next_subreddits(all_subreddits: List[str], batch_size: int = 3) -> Tuple[List[str], int, int]:
+    """
+    Get next batch of subreddits to scan, rotating through the list.
+    Returns (batch, current_batch, total_batches) so callers don't need to re-read the scan state.
+    The new state is only persisted by flush_scan_state().
+    """
+    global _scan_state_dirty
+    with _lock:
+        state = _load_scan_state()
+        next_index = state.get("next_index", 0)
+        
+        # Get next batch
+        total = len(all_subreddits)
+        if next_index >= total:
+            next_index = 0
+        
+        end_index = min(next_index + batch_size, total)
+        batch = all_subreddits[next_index:end_index]
+        
+        # If we need more to fill the batch, wrap around
+        if len(batch) < batch_size and next_index > 0:
+            remaining = batch_size - len(batch)
+            batch.extend(all_subreddits[:remaining])
+            state["next_index"] = remaining
+        else:
+            state["next_index"] = end_index if end_index < total else 0
+        
+        state["last_scan"] = datetime.now().isoformat()
+        state["last_batch"] = batch
+        _scan_state_dirty = True
     
-    # Get next batch
-    total = len(all_subreddits)
-    if next_index >= total:
-        next_index = 0
-    
-    end_index = min(next_index + batch_size, total)
-    batch = all_subreddits[next_index:end_index]
-    
-    # If we need more to fill the batch, wrap around
-    if len(batch) < batch_size and next_index > 0:
-        remaining = batch_size - len(batch)
-        batch.extend(all_subreddits[:remaining])
-        state["next_index"] = remaining
-    else:
-        state["next_index"] = end_index if end_index < total else 0
-    
-    state["last_scan"] = datetime.now().isoformat()
-    state["last_batch"] = batch
-    _save_scan_state(state)
-    
-    return batch
+    total_batches = (total + batch_size - 1) // batch_size
+    return batch, _batch_number(state["next_index"], total, batch_size), total_batches
+
+
+def load_subreddit_rules() -> Dict[str, Dict[str, Any]]:
+    """Load persisted subreddit rules as {subreddit: {"rules": ..., "fetched_at": epoch seconds}}."""
+    if os.path.exists(SUBREDDIT_RULES_FILE):
+        with open(SUBREDDIT_RULES_FILE, "rb") as f:
+            return orjson.loads(f.read())
+    return {}
+
+
+def save_subreddit_rules(subreddit: str, rules: Dict[str, Any], fetched_at: float) -> None:
+    """Persist the fetched rules for one subreddit."""
+    with _rules_lock:
+        all_rules = load_subreddit_rules()
+        all_rules[subreddit] = {"rules": rules, "fetched_at": fetched_at}
+        _write_atomic(SUBREDDIT_RULES_FILE, orjson.dumps(all_rules))
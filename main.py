@@ -4,9 +4,14 @@ FastAPI Backend for Reddit Automation Dashboard
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from pydantic import BaseModel, ConfigDict
+from typing import Optional, List, AsyncIterator
 import os
+import orjson
+import asyncio
+import time
+from collections import Counter
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,13 +19,8 @@ load_dotenv()
 from reddit_scanner import RedditScanner
 from comment_generator import CommentGenerator
 
-# Use Supabase storage if configured, otherwise fall back to local storage
-if os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY"):
-    import supabase_storage as storage
-else:
-    import local_storage as storage
-
-app = FastAPI(title="Reddit Automation API", version="1.0.0")
+# orjson-backed responses skip the stdlib json encoder for every endpoint
+app = FastAPI(title="Reddit Automation API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS for frontend
 app.add_middleware(
@@ -31,15 +31,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opportunity list shared by the dashboard endpoints, re-read at most every few seconds
+OPPORTUNITIES_CACHE_TTL = 5
+_opportunities_cache = {"expires": 0.0, "data": None}
+
 # Initialize components
 scanner = None
 generator = None
+storage = None
 
 
 def get_scanner():
     global scanner
     if scanner is None:
-        scanner = RedditScanner()
+        scanner = RedditScanner(storage=get_storage())
     return scanner
 
 
@@ -50,8 +55,40 @@ def get_generator():
     return generator
 
 
+def get_storage():
+    # Use Supabase storage if configured, otherwise fall back to local storage.
+    # Imported on first use so startup doesn't pay for the Supabase client.
+    global storage
+    if storage is None:
+        if os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY"):
+            import supabase_storage as storage
+        else:
+            import local_storage as storage
+    return storage
+
+
+def get_cached_opportunities() -> list:
+    """All opportunities, served from a short-lived cache."""
+    now = time.monotonic()
+    if _opportunities_cache["data"] is None or now >= _opportunities_cache["expires"]:
+        opportunities = get_storage().get_all_opportunities()
+        _opportunities_cache["data"] = opportunities
+        _opportunities_cache["expires"] = now + OPPORTUNITIES_CACHE_TTL
+    return _opportunities_cache["data"]
+
+
+def invalidate_opportunities_cache():
+    """Drop the cached opportunity list after a write."""
+    _opportunities_cache["data"] = None
+
+
 # Pydantic models
-class Opportunity(BaseModel):
+class FrozenModel(BaseModel):
+    """Immutable base model; unknown fields are ignored rather than stored."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+
+class Opportunity(FrozenModel):
     id: str
     type: str
     intent: str
@@ -75,19 +112,19 @@ class Opportunity(BaseModel):
     reply_url: Optional[str] = None
 
 
-class StatusUpdate(BaseModel):
+class StatusUpdate(FrozenModel):
     status: str
 
 
-class ReplyUpdate(BaseModel):
+class ReplyUpdate(FrozenModel):
     reply_url: str
 
 
-class FeedbackUpdate(BaseModel):
+class FeedbackUpdate(FrozenModel):
     feedback: str
 
 
-class TrackedReply(BaseModel):
+class TrackedReply(FrozenModel):
     opportunity_id: str
     opportunity_url: str
     reply_url: str
@@ -103,12 +140,13 @@ async def root():
     return {"message": "Reddit Automation API", "status": "running"}
 
 
-@app.get("/api/opportunities", response_model=List[dict])
+@app.get("/api/opportunities")
 async def get_opportunities():
     """Fetch all opportunities from local storage."""
     try:
-        opportunities = storage.get_all_opportunities()
-        return opportunities
+        opportunities = await asyncio.to_thread(get_cached_opportunities)
+        # Storage already returns plain dicts, so pass them straight through
+        return ORJSONResponse(content=opportunities)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -117,38 +155,62 @@ async def get_opportunities():
 async def update_opportunity_status(opportunity_id: str, update: StatusUpdate):
     """Update the status of an opportunity."""
     try:
-        storage.update_opportunity_status(opportunity_id, update.status)
+        await asyncio.to_thread(get_storage().update_opportunity_status, opportunity_id, update.status)
+        invalidate_opportunities_cache()
         return {"success": True, "id": opportunity_id, "status": update.status}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _fetch_initial_score(reply_url: str) -> int:
+    """Current score of a just-posted reply, or 0 if it can't be fetched."""
+    try:
+        return await asyncio.to_thread(get_scanner().get_comment_score, reply_url)
+    except Exception:
+        return 0
+
+
+async def save_reply_and_metric(opportunity_id: str, reply_url: str):
+    """
+    Save a reply URL and, where the backend tracks comment metrics and the opportunity exists,
+    its initial metrics. The reply URL write never depends on the metric steps succeeding.
+    """
+    storage = get_storage()
+    save_reply = storage.save_reply_url
+    # Local storage has no comment metrics; only the Supabase backend tracks them
+    save_metric = getattr(storage, "save_comment_metric", None)
+    if save_metric is None:
+        await asyncio.to_thread(save_reply, opportunity_id, reply_url)
+        return
+    
+    # The reply URL write and the opportunity lookup (for the metric) are independent round-trips
+    _, opp = await asyncio.gather(
+        asyncio.to_thread(save_reply, opportunity_id, reply_url),
+        asyncio.to_thread(storage.get_opportunity, opportunity_id)
+    )
+    if not opp:
+        return
+    
+    initial_score = await _fetch_initial_score(reply_url)
+    await asyncio.to_thread(
+        save_metric,
+        opportunity_id=opportunity_id,
+        reply_url=reply_url,
+        subreddit=opp.get("subreddit", ""),
+        persona=opp.get("recommended_persona", ""),
+        initial_score=initial_score
+    )
+
+
 @app.patch("/api/opportunities/{opportunity_id}/reply")
 async def save_reply_url(opportunity_id: str, update: ReplyUpdate):
     """Save the reply URL for an opportunity and track initial metrics."""
     try:
-        # Get opportunity details for metrics
-        opportunities = storage.get_all_opportunities()
-        opp = next((o for o in opportunities if o.get("id") == opportunity_id), None)
-        
-        # Save reply URL
-        storage.save_reply_url(opportunity_id, update.reply_url)
-        
-        # Get initial score from Reddit and save metrics
-        if opp:
-            scanner = get_scanner()
-            try:
-                initial_score = scanner.get_comment_score(update.reply_url)
-            except:
-                initial_score = 0
-            
-            storage.save_comment_metric(
-                opportunity_id=opportunity_id,
-                reply_url=update.reply_url,
-                subreddit=opp.get("subreddit", ""),
-                persona=opp.get("recommended_persona", ""),
-                initial_score=initial_score
-            )
+        try:
+            await save_reply_and_metric(opportunity_id, update.reply_url)
+        finally:
+            # The reply URL may be saved even if the metric step fails
+            invalidate_opportunities_cache()
         
         return {"success": True, "id": opportunity_id, "reply_url": update.reply_url}
     except Exception as e:
@@ -159,29 +221,32 @@ async def save_reply_url(opportunity_id: str, update: ReplyUpdate):
 async def save_feedback(opportunity_id: str, update: FeedbackUpdate):
     """Save feedback for an opportunity and mark as skipped."""
     try:
-        storage.save_feedback(opportunity_id, update.feedback)
+        await asyncio.to_thread(get_storage().save_feedback, opportunity_id, update.feedback)
+        invalidate_opportunities_cache()
         return {"success": True, "id": opportunity_id, "feedback": update.feedback}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/replies", response_model=List[dict])
+@app.get("/api/replies")
 async def get_tracked_replies():
     """Get all tracked replies with performance metrics."""
     try:
         scanner = get_scanner()
-        replies = storage.get_tracked_replies()
+        replies = await asyncio.to_thread(get_storage().get_tracked_replies)
         
-        # Fetch current scores from Reddit
+        # Fetch current scores from Reddit in batched requests
+        reply_urls = [reply["reply_url"] for reply in replies if reply.get("reply_url")]
+        try:
+            scores = await asyncio.to_thread(scanner.get_comment_scores, reply_urls)
+        except Exception as e:
+            print(f"Error fetching comment scores: {e}")
+            scores = {}
         for reply in replies:
-            if reply.get("reply_url"):
-                try:
-                    current_score = scanner.get_comment_score(reply["reply_url"])
-                    reply["current_score"] = current_score
-                except:
-                    pass
+            if reply.get("reply_url") in scores:
+                reply["current_score"] = scores[reply["reply_url"]]
         
-        return replies
+        return ORJSONResponse(content=replies)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -193,28 +258,34 @@ async def trigger_scan():
         scanner = get_scanner()
         generator = get_generator()
         
-        # Get existing URLs to avoid duplicates
-        existing_urls = storage.get_existing_urls()
-        
         # Get next batch of subreddits to scan (rotates through all)
         import dynamic_config
         all_subreddits = dynamic_config.get_all_subreddits()
         batch_size = dynamic_config.get_subreddits_per_scan()
         posts_per_sub = dynamic_config.get_posts_per_subreddit()
-        next_subs = storage.get_next_subreddits(all_subreddits, batch_size=batch_size)
+        next_subs, current_batch, total_batches = await asyncio.to_thread(
+            get_storage().get_next_subreddits, all_subreddits, batch_size=batch_size
+        )
         
-        results = []
-        for sub in next_subs:
-            sub_results = scanner.scan_subreddit(sub, limit=posts_per_sub)
-            results.extend(sub_results)
+        # Scan the batch concurrently; each scan is a blocking Reddit round-trip.
+        # The advanced rotation is persisted alongside the scans rather than before them.
+        *results_lists, _ = await asyncio.gather(
+            *[asyncio.to_thread(scanner.scan_subreddit, sub, limit=posts_per_sub) for sub in next_subs],
+            asyncio.to_thread(get_storage().flush_scan_state)
+        )
         
-        # Filter out duplicates
-        new_results = [r for r in results if r["url"] not in existing_urls]
+        # Prepare results in a single pass; posts already stored are dropped by the unique url index on insert
+        total_scanned = 0
+        new_results = []
+        for sub_results in results_lists:
+            for result in sub_results:
+                total_scanned += 1
+                result["comment_suggestion"] = generator.generate_suggestion(result)
+                result["status"] = "pending"
+                result["reply_url"] = ""
+                new_results.append(result)
         
-        # Get scan progress info
         total_subreddits = len(all_subreddits)
-        total_batches = (total_subreddits + batch_size - 1) // batch_size  # Ceiling division
-        current_batch = storage.get_current_batch_number(total_subreddits, batch_size)
         
         if not new_results:
             return {
@@ -226,21 +297,15 @@ async def trigger_scan():
                 "total_subreddits": total_subreddits
             }
         
-        # Generate comment suggestions
-        for result in new_results:
-            suggestion = generator.generate_suggestion(result)
-            result["comment_suggestion"] = suggestion
-            result["status"] = "pending"
-            result["reply_url"] = ""
-        
-        # Save to local storage
-        storage.append_opportunities(new_results)
+        # Storage skips URLs that are already saved, so only genuinely new posts are counted
+        inserted = await asyncio.to_thread(get_storage().append_opportunities, new_results)
+        invalidate_opportunities_cache()
         
         return {
             "success": True,
-            "new_opportunities": len(new_results),
-            "total_scanned": len(results),
-            "duplicates_skipped": len(results) - len(new_results),
+            "new_opportunities": inserted,
+            "total_scanned": total_scanned,
+            "duplicates_skipped": total_scanned - inserted,
             "subreddits_scanned": next_subs,
             "scan_progress": f"{current_batch} of {total_batches}",
             "total_subreddits": total_subreddits
@@ -253,7 +318,7 @@ async def trigger_scan():
 async def reset_scan():
     """Reset scan state to start fresh."""
     try:
-        storage.reset_scan_state()
+        await asyncio.to_thread(get_storage().reset_scan_state)
         # Also reset the scanner's seen_posts
         scanner = get_scanner()
         scanner.seen_posts.clear()
@@ -298,44 +363,52 @@ async def debug_info():
 async def get_stats():
     """Get dashboard statistics."""
     try:
-        opportunities = storage.get_all_opportunities()
+        opportunities = await asyncio.to_thread(get_cached_opportunities)
+        
+        # Count statuses and intents in a single pass
+        status_counts = Counter()
+        intent_counts = Counter()
+        for o in opportunities:
+            status_counts[o.get("status")] += 1
+            intent_counts[o.get("intent")] += 1
         
         total = len(opportunities)
-        pending = sum(1 for o in opportunities if o.get("status") == "pending")
-        in_progress = sum(1 for o in opportunities if o.get("status") == "in_progress")
-        replied = sum(1 for o in opportunities if o.get("status") == "replied")
-        high_intent = sum(1 for o in opportunities if o.get("intent") == "HIGH")
+        high_intent = intent_counts["HIGH"]
         
-        return {
+        return ORJSONResponse(content={
             "total": total,
-            "pending": pending,
-            "in_progress": in_progress,
-            "replied": replied,
+            "pending": status_counts["pending"],
+            "in_progress": status_counts["in_progress"],
+            "replied": status_counts["replied"],
             "high_intent": high_intent,
             "low_intent": total - high_intent
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _refresh_metric_scores(scanner, metrics: list) -> int:
+    """Fetch current scores for tracked comments in batched requests and store them. Returns how many were updated."""
+    tracked = [metric for metric in metrics if metric.get("reply_url") and metric.get("opportunity_id")]
+    scores = scanner.get_comment_scores([metric["reply_url"] for metric in tracked])
+    
+    # Write every refreshed score back in one bulk update
+    new_scores = {
+        metric["opportunity_id"]: scores[metric["reply_url"]]
+        for metric in tracked
+        if metric["reply_url"] in scores
+    }
+    get_storage().update_comment_scores(new_scores)
+    return len(new_scores)
+
+
 @app.post("/api/refresh-scores")
 async def refresh_scores():
     """Refresh upvote scores for all tracked comments."""
     try:
         scanner = get_scanner()
-        metrics = storage.get_all_comment_metrics()
-        updated = 0
-        
-        for metric in metrics:
-            reply_url = metric.get("reply_url")
-            opp_id = metric.get("opportunity_id")
-            if reply_url and opp_id:
-                try:
-                    current_score = scanner.get_comment_score(reply_url)
-                    storage.update_comment_score(opp_id, current_score)
-                    updated += 1
-                except:
-                    pass
+        metrics = await asyncio.to_thread(get_storage().get_all_comment_metrics)
+        updated = await asyncio.to_thread(_refresh_metric_scores, scanner, metrics)
         
         return {"success": True, "updated": updated, "total": len(metrics)}
     except Exception as e:
@@ -346,25 +419,27 @@ async def refresh_scores():
 async def get_analytics():
     """Get comment performance analytics."""
     try:
-        summary = storage.get_analytics_summary()
-        metrics = storage.get_all_comment_metrics()
-        return {
+        summary, metrics = await asyncio.gather(
+            asyncio.to_thread(get_storage().get_analytics_summary),
+            asyncio.to_thread(get_storage().get_all_comment_metrics)
+        )
+        return ORJSONResponse(content={
             "success": True,
             "summary": summary,
             "metrics": metrics
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # ============== ADMIN ENDPOINTS ==============
 
-class ChatMessage(BaseModel):
+class ChatMessage(FrozenModel):
     message: str
     conversation_history: Optional[List[dict]] = None
 
 
-class ApplyChanges(BaseModel):
+class ApplyChanges(FrozenModel):
     changes_text: str
 
 
@@ -384,11 +459,22 @@ async def get_skipped_posts():
 
 
 @app.post("/api/admin/recommendations")
-async def get_ai_recommendations():
-    """Generate AI recommendations based on skipped posts."""
+async def get_ai_recommendations(refresh: bool = False):
+    """Generate AI recommendations based on skipped posts. Pass refresh=true to regenerate."""
     try:
         import ai_recommendations
-        result = ai_recommendations.generate_recommendations()
+        result = await ai_recommendations.generate_recommendations(refresh=refresh)
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/admin/recommendations/by-persona")
+async def get_ai_recommendations_by_persona():
+    """Generate AI recommendations for every persona in a single AI call."""
+    try:
+        import ai_recommendations
+        result = await ai_recommendations.generate_recommendations_batched()
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -399,7 +485,7 @@ async def chat_with_ai(chat: ChatMessage):
     """Chat with AI about recommendations."""
     try:
         import ai_recommendations
-        result = ai_recommendations.chat_with_ai(
+        result = await ai_recommendations.chat_with_ai(
             chat.message, 
             chat.conversation_history
         )
@@ -408,12 +494,43 @@ async def chat_with_ai(chat: ChatMessage):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _sse(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """Forward text chunks as server-sent events, ending with [DONE]."""
+    try:
+        async for chunk in chunks:
+            if chunk:
+                yield b"data: " + orjson.dumps({"delta": chunk}) + b"\n\n"
+    except Exception as e:
+        yield b"data: " + orjson.dumps({"error": str(e)}) + b"\n\n"
+    yield b"data: [DONE]\n\n"
+
+
+@app.post("/api/admin/recommendations/stream")
+async def stream_ai_recommendations():
+    """Stream AI recommendations as server-sent events."""
+    import ai_recommendations
+    return StreamingResponse(
+        _sse(ai_recommendations.stream_recommendations()),
+        media_type="text/event-stream"
+    )
+
+
+@app.post("/api/admin/chat/stream")
+async def stream_chat_with_ai(chat: ChatMessage):
+    """Stream the AI chat reply as server-sent events."""
+    import ai_recommendations
+    return StreamingResponse(
+        _sse(ai_recommendations.stream_chat(chat.message, chat.conversation_history)),
+        media_type="text/event-stream"
+    )
+
+
 @app.post("/api/admin/apply-changes")
 async def apply_ai_changes(changes: ApplyChanges):
     """Parse and apply AI-recommended changes to configuration."""
     try:
         import ai_recommendations
-        result = ai_recommendations.parse_and_apply_changes(changes.changes_text)
+        result = await ai_recommendations.parse_and_apply_changes(changes.changes_text)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -437,4 +554,13 @@ async def get_current_config():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Caches and local storage live in-process, so extra workers are opt-in via WEB_CONCURRENCY
+    # (only safe with the Supabase backend)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
@@ -5,16 +5,92 @@ Scans designated subreddits for posts and comments matching interview-related ke
 
 import os
 import re
+import time
 import praw
 from datetime import datetime, timezone
+from functools import lru_cache
 from dotenv import load_dotenv
 import dynamic_config
 
 load_dotenv()
 
+# Strong disqualifiers - if present, definitely not relevant
+STRONG_DISQUALIFIERS = [
+    "focus group", "market research", "paid study", "cat food", "dog food",
+    "scam", "legitimacy", "fake job", "pyramid scheme",
+    "resume review", "cover letter", "job application form",
+    "salary negotiation", "offer letter", "signing bonus", "counter offer",
+    "quit my job", "toxic boss", "work life balance", "layoff", "fired",
+]
+
+# Strong qualifiers - if present, definitely relevant
+STRONG_QUALIFIERS = [
+    "interview prep", "preparing for interview", "interview tips",
+    "coding interview", "technical interview", "behavioral interview",
+    "system design interview", "case study interview",
+    "how to prepare", "practice questions", "mock interview",
+    "interview coming up", "have an interview", "got an interview",
+    "interview next week", "interview tomorrow", "upcoming interview",
+    "what to expect in interview", "interview process at",
+    "data science interview", "data analyst interview", "sql interview",
+    "python interview", "machine learning interview",
+    "leetcode", "hackerrank", "codesignal", "online assessment",
+]
+
+# Comment id from desktop, old and share-style comment URLs (.../comments/<post>/<slug or "comment">/<id>)
+_COMMENT_ID_RE = re.compile(r"/comments/\w+/[^/]*/(\w+)")
+
+HIGH_INTENT_SIGNALS = [
+    "interview questions",
+    "interview process",
+    "interview prep",
+    "preparing for interview",
+    "got an interview",
+    "have an interview",
+    "interview coming up",
+    "technical interview",
+    "coding interview",
+    "failed interview",
+    "flunked interview",
+]
+
+# Any-match checks only need to know whether one phrase occurs, so a plain alternation is enough
+_DISQUALIFIER_RE = re.compile("|".join(map(re.escape, STRONG_DISQUALIFIERS)))
+_QUALIFIER_RE = re.compile("|".join(map(re.escape, STRONG_QUALIFIERS)))
+_HIGH_INTENT_RE = re.compile("|".join(map(re.escape, HIGH_INTENT_SIGNALS)))
+
+
+@lru_cache(maxsize=64)
+def _phrase_matcher(phrases: tuple):
+    """
+    Compile phrases into one regex that finds every occurring phrase in a single pass.
+    Returns (regex, prefixes), where prefixes maps each phrase to the phrases it starts with.
+    """
+    # The lookahead lets matches overlap; longest-first means the phrase matched at a position
+    # is the longest one there, and every other phrase matching at that position is its prefix
+    ordered = sorted(set(phrases), key=len, reverse=True)
+    regex = re.compile("(?=(" + "|".join(map(re.escape, ordered)) + "))")
+    prefixes = {phrase: [p for p in ordered if phrase.startswith(p)] for phrase in ordered}
+    return regex, prefixes
+
+
+def _find_phrases(phrases: tuple, text: str) -> set:
+    """Return the set of phrases that occur anywhere in text, same as checking `phrase in text` for each."""
+    if not phrases:
+        return set()
+    regex, prefixes = _phrase_matcher(phrases)
+    found = set()
+    for match in regex.finditer(text):
+        found.update(prefixes[match.group(1)])
+    return found
+
+
+# Persisted subreddit rules are refetched after this long
+RULES_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
 
 class RedditScanner:
-    def __init__(self):
+    def __init__(self, storage=None):
         self.reddit = praw.Reddit(
             client_id=os.getenv("REDDIT_CLIENT_ID"),
             client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
@@ -23,6 +99,9 @@ class RedditScanner:
             user_agent="InterviewQueryScanner/1.0 by u/DreXkind"
         )
         self.subreddit_rules_cache = {}
+        # Optional storage module used to persist subreddit rules across restarts
+        self.storage = storage
+        self._persisted_rules_loaded = False
         self.last_scan_timestamp = None
         self.seen_posts = set()  # Track post IDs to avoid duplicates
     
@@ -31,6 +110,11 @@ class RedditScanner:
         if subreddit_name in self.subreddit_rules_cache:
             return self.subreddit_rules_cache[subreddit_name]
         
+        if self.storage is not None and not self._persisted_rules_loaded:
+            self._load_persisted_rules()
+            if subreddit_name in self.subreddit_rules_cache:
+                return self.subreddit_rules_cache[subreddit_name]
+        
         try:
             subreddit = self.reddit.subreddit(subreddit_name)
             rules = []
@@ -54,6 +138,11 @@ class RedditScanner:
                 "self_promo_allowed": self_promo_allowed,
             }
             self.subreddit_rules_cache[subreddit_name] = result
+            if self.storage is not None:
+                try:
+                    self.storage.save_subreddit_rules(subreddit_name, result, time.time())
+                except Exception as e:
+                    print(f"Error saving rules for r/{subreddit_name}: {e}")
             return result
         except Exception as e:
             return {
@@ -62,22 +151,40 @@ class RedditScanner:
                 "self_promo_allowed": True,
             }
     
-    def matches_keywords(self, text: str) -> list:
+    def _load_persisted_rules(self):
+        """Seed the rules cache with persisted rules that haven't expired."""
+        self._persisted_rules_loaded = True
+        try:
+            persisted = self.storage.load_subreddit_rules()
+        except Exception as e:
+            print(f"Error loading persisted subreddit rules: {e}")
+            return
+        cutoff = time.time() - RULES_CACHE_TTL_SECONDS
+        for name, entry in persisted.items():
+            if entry.get("fetched_at", 0) >= cutoff:
+                self.subreddit_rules_cache.setdefault(name, entry["rules"])
+    
+    def _config_snapshot(self) -> dict:
+        """Read the matcher settings from config once, so a scan doesn't re-read them per post."""
+        keywords = dynamic_config.get_keywords()
+        return {
+            "keywords": keywords,
+            "keyword_phrases": tuple(k.lower() for k in keywords),
+            "relevant_signals": tuple(dynamic_config.get_relevant_signals()),
+            "companies": tuple(dynamic_config.get_companies()),
+            "resources": dynamic_config.get_resources(),
+        }
+    
+    def matches_keywords(self, text: str, text_lower: str = None, snapshot: dict = None) -> list:
         """Check if text matches any keywords. Returns list of matched keywords."""
         if not text:
             return []
         
-        text_lower = text.lower()
-        matched = []
-        keywords = dynamic_config.get_keywords()
-        
-        for keyword in keywords:
-            if keyword.lower() in text_lower:
-                matched.append(keyword)
-        
-        return matched
+        snapshot = snapshot or self._config_snapshot()
+        found = _find_phrases(snapshot["keyword_phrases"], text_lower or text.lower())
+        return [keyword for keyword in snapshot["keywords"] if keyword.lower() in found]
     
-    def is_relevant_to_interview_query(self, text: str) -> bool:
+    def is_relevant_to_interview_query(self, text: str, text_lower: str = None, snapshot: dict = None) -> bool:
         """
         Check if post is relevant to Interview Query's services.
         Used when 'interview' is matched broadly to filter out irrelevant posts.
@@ -89,74 +196,37 @@ class RedditScanner:
         if not text:
             return False
         
-        text_lower = text.lower()
+        text_lower = text_lower or text.lower()
         
-        # Strong disqualifiers - if present, definitely not relevant
-        strong_disqualifiers = [
-            "focus group", "market research", "paid study", "cat food", "dog food",
-            "scam", "legitimacy", "fake job", "pyramid scheme",
-            "resume review", "cover letter", "job application form",
-            "salary negotiation", "offer letter", "signing bonus", "counter offer",
-            "quit my job", "toxic boss", "work life balance", "layoff", "fired",
-        ]
-        for disqualifier in strong_disqualifiers:
-            if disqualifier in text_lower:
-                return False
+        if _DISQUALIFIER_RE.search(text_lower):
+            return False
         
-        # Strong qualifiers - if present, definitely relevant
-        strong_qualifiers = [
-            "interview prep", "preparing for interview", "interview tips",
-            "coding interview", "technical interview", "behavioral interview",
-            "system design interview", "case study interview",
-            "how to prepare", "practice questions", "mock interview",
-            "interview coming up", "have an interview", "got an interview",
-            "interview next week", "interview tomorrow", "upcoming interview",
-            "what to expect in interview", "interview process at",
-            "data science interview", "data analyst interview", "sql interview",
-            "python interview", "machine learning interview",
-            "leetcode", "hackerrank", "codesignal", "online assessment",
-        ]
-        for qualifier in strong_qualifiers:
-            if qualifier in text_lower:
-                return True
+        if _QUALIFIER_RE.search(text_lower):
+            return True
         
         # Check for relevant signals (need at least 2 for weaker matches)
-        relevant_signals = dynamic_config.get_relevant_signals()
-        relevant_count = sum(1 for signal in relevant_signals if signal in text_lower)
+        relevant_signals = (snapshot or self._config_snapshot())["relevant_signals"]
+        found = _find_phrases(relevant_signals, text_lower)
+        relevant_count = sum(1 for signal in relevant_signals if signal in found)
         
         # Must have at least 2 relevant signals for posts that only matched "interview"
         return relevant_count >= 2
     
-    def detect_companies(self, text: str) -> list:
+    def detect_companies(self, text: str, text_lower: str = None, snapshot: dict = None) -> list:
         """Detect company names mentioned in text."""
         if not text:
             return []
         
-        text_lower = text.lower()
-        companies = dynamic_config.get_companies()
-        return [company for company in companies if company in text_lower]
+        companies = (snapshot or self._config_snapshot())["companies"]
+        found = _find_phrases(companies, text_lower or text.lower())
+        return [company for company in companies if company in found]
     
-    def get_intent_level(self, text: str, matched_keywords: list) -> str:
+    def get_intent_level(self, text: str, matched_keywords: list, text_lower: str = None) -> str:
         """Determine if post/comment is HIGH or LOW intent."""
-        text_lower = text.lower() if text else ""
-        
-        high_intent_signals = [
-            "interview questions",
-            "interview process",
-            "interview prep",
-            "preparing for interview",
-            "got an interview",
-            "have an interview",
-            "interview coming up",
-            "technical interview",
-            "coding interview",
-            "failed interview",
-            "flunked interview",
-        ]
+        text_lower = text_lower or (text.lower() if text else "")
         
-        for signal in high_intent_signals:
-            if signal in text_lower:
-                return "HIGH"
+        if _HIGH_INTENT_RE.search(text_lower):
+            return "HIGH"
         
         if any("interview" in kw.lower() for kw in matched_keywords):
             return "HIGH"
@@ -165,25 +235,23 @@ class RedditScanner:
     
     def get_recommended_persona(self, subreddit_name: str) -> str:
         """Get recommended persona based on subreddit."""
-        subreddits = dynamic_config.get_subreddits()
-        for persona, subs in subreddits.items():
-            if subreddit_name.lower() in [s.lower() for s in subs]:
-                return persona
-        return "warmeggnog"  # Default
+        return dynamic_config.get_subreddit_personas().get(subreddit_name.lower(), "warmeggnog")  # Default
     
-    def get_suggested_resource(self, text: str, matched_keywords: list) -> str:
+    def get_suggested_resource(self, text: str, matched_keywords: list, text_lower: str = None, snapshot: dict = None) -> str:
         """Suggest an Interview Query resource based on content."""
-        text_lower = text.lower() if text else ""
+        text_lower = text_lower or (text.lower() if text else "")
         keywords_lower = " ".join(matched_keywords).lower()
         combined = text_lower + " " + keywords_lower
-        resources = dynamic_config.get_resources()
+        snapshot = snapshot or self._config_snapshot()
+        resources = snapshot["resources"]
         
+        found = _find_phrases(tuple(resources), combined)
         for topic, url in resources.items():
-            if topic in combined:
+            if topic in found:
                 return url
         
         # Default to company guides if company mentioned
-        if self.detect_companies(text):
+        if self.detect_companies(text, text_lower, snapshot):
             return resources.get("company guides", "")
         
         return ""
@@ -203,6 +271,9 @@ class RedditScanner:
             # Get persona for this subreddit once
             persona = self.get_recommended_persona(subreddit_name)
             
+            # Read matcher settings once for the whole batch of posts
+            snapshot = self._config_snapshot()
+            
             # Scan new posts (limit controls how many to fetch)
             for post in subreddit.new(limit=limit):
                 # Skip posts older than 48 hours
@@ -216,24 +287,27 @@ class RedditScanner:
                     continue
                     
                 self.seen_posts.add(post.id)
+                url = f"https://reddit.com{post.permalink}"
                 post_text = f"{post.title} {post.selftext}"
-                matched_keywords = self.matches_keywords(post_text)
+                # Lowercase once and share it with every matcher below
+                text_lower = post_text.lower()
+                matched_keywords = self.matches_keywords(post_text, text_lower, snapshot)
                 
                 if matched_keywords:
                     # If only "interview" matched, check relevance to Interview Query
-                    if matched_keywords == ["interview"] and not self.is_relevant_to_interview_query(post_text):
+                    if matched_keywords == ["interview"] and not self.is_relevant_to_interview_query(post_text, text_lower, snapshot):
                         continue  # Skip irrelevant posts that only matched "interview"
                     
-                    companies = self.detect_companies(post_text)
-                    intent = self.get_intent_level(post_text, matched_keywords)
-                    resource = self.get_suggested_resource(post_text, matched_keywords)
+                    companies = self.detect_companies(post_text, text_lower, snapshot)
+                    intent = self.get_intent_level(post_text, matched_keywords, text_lower)
+                    resource = self.get_suggested_resource(post_text, matched_keywords, text_lower, snapshot)
                     
                     results.append({
                         "type": "post",
                         "subreddit": subreddit_name,
                         "title": post.title[:200],
                         "text_snippet": post.selftext[:300] if post.selftext else "",
-                        "url": f"https://reddit.com{post.permalink}",
+                        "url": url,
                         "author": str(post.author) if post.author else "[deleted]",
                         "score": post.score,
                         "num_comments": post.num_comments,
@@ -281,18 +355,35 @@ class RedditScanner:
     def get_comment_score(self, comment_url: str) -> int:
         """Get the current score of a comment by URL."""
         try:
-            # Extract comment ID from URL
-            # URL format: https://reddit.com/r/subreddit/comments/post_id/title/comment_id
-            parts = comment_url.rstrip('/').split('/')
-            comment_id = parts[-1] if parts else None
-            
-            if comment_id:
-                comment = self.reddit.comment(id=comment_id)
+            # Skip the Reddit call entirely if the URL doesn't point at a comment
+            match = _COMMENT_ID_RE.search(comment_url)
+            if match:
+                comment = self.reddit.comment(id=match.group(1))
                 return comment.score
         except Exception as e:
             print(f"Error fetching comment score: {e}")
         
         return 0
+    
+    def get_comment_scores(self, comment_urls: list) -> dict:
+        """
+        Get current scores for many comments by URL, fetching up to 100 per request.
+        Returns a dict of url -> score for the comments Reddit returned; errors propagate to the caller.
+        """
+        urls_by_id = {}
+        for url in comment_urls:
+            match = _COMMENT_ID_RE.search(url)
+            if match:
+                urls_by_id.setdefault(match.group(1), []).append(url)
+        
+        scores = {}
+        comment_ids = list(urls_by_id)
+        for i in range(0, len(comment_ids), 100):
+            fullnames = [f"t1_{comment_id}" for comment_id in comment_ids[i:i + 100]]
+            for comment in self.reddit.info(fullnames=fullnames):
+                for url in urls_by_id.get(comment.id, []):
+                    scores[url] = comment.score
+        return scores
 
 
 if __name__ == "__main__":
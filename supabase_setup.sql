@@ -23,12 +23,19 @@ CREATE TABLE IF NOT EXISTS opportunities (
     comment_suggestion TEXT,
     status TEXT DEFAULT 'pending',
     reply_url TEXT,
+    has_replied BOOLEAN DEFAULT FALSE,
     reply_timestamp TEXT,
     feedback TEXT,
     scan_time TEXT,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Replied flag for tables created before it existed; a partial index serves get_tracked_replies()
+-- (an index can't help the old reply_url <> '' filter)
+ALTER TABLE opportunities ADD COLUMN IF NOT EXISTS has_replied BOOLEAN DEFAULT FALSE;
+UPDATE opportunities SET has_replied = TRUE WHERE reply_url <> '' AND NOT has_replied;
+CREATE INDEX IF NOT EXISTS opportunities_has_replied_idx ON opportunities (has_replied) WHERE has_replied;
+
 -- Scan state table
 CREATE TABLE IF NOT EXISTS scan_state (
     id INTEGER PRIMARY KEY DEFAULT 1,
@@ -37,13 +44,136 @@ CREATE TABLE IF NOT EXISTS scan_state (
     last_batch JSONB
 );
 
+-- Subreddit rules cache (fetched_at is epoch seconds; rules are refetched after a week)
+CREATE TABLE IF NOT EXISTS subreddit_rules (
+    subreddit TEXT PRIMARY KEY,
+    rules JSONB,
+    fetched_at DOUBLE PRECISION
+);
+
+-- Comment metrics table (one row per replied opportunity)
+CREATE TABLE IF NOT EXISTS comment_metrics (
+    opportunity_id TEXT PRIMARY KEY,
+    reply_url TEXT,
+    subreddit TEXT,
+    persona TEXT,
+    initial_score INTEGER DEFAULT 0,
+    current_score INTEGER DEFAULT 0,
+    last_updated TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- Insert initial scan state
 INSERT INTO scan_state (id, next_index) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
 
 -- Enable Row Level Security (optional but recommended)
 ALTER TABLE opportunities ENABLE ROW LEVEL SECURITY;
 ALTER TABLE scan_state ENABLE ROW LEVEL SECURITY;
+ALTER TABLE subreddit_rules ENABLE ROW LEVEL SECURITY;
+ALTER TABLE comment_metrics ENABLE ROW LEVEL SECURITY;
 
--- Allow public access (since we're using anon key)
+-- Allow public access (since we're using anon key); dropped first so this script can be re-run
+DROP POLICY IF EXISTS "Allow all access to opportunities" ON opportunities;
 CREATE POLICY "Allow all access to opportunities" ON opportunities FOR ALL USING (true) WITH CHECK (true);
+DROP POLICY IF EXISTS "Allow all access to scan_state" ON scan_state;
 CREATE POLICY "Allow all access to scan_state" ON scan_state FOR ALL USING (true) WITH CHECK (true);
+DROP POLICY IF EXISTS "Allow all access to subreddit_rules" ON subreddit_rules;
+CREATE POLICY "Allow all access to subreddit_rules" ON subreddit_rules FOR ALL USING (true) WITH CHECK (true);
+DROP POLICY IF EXISTS "Allow all access to comment_metrics" ON comment_metrics;
+CREATE POLICY "Allow all access to comment_metrics" ON comment_metrics FOR ALL USING (true) WITH CHECK (true);
+
+-- Analytics summary aggregated server-side (called via client.rpc("analytics_summary"))
+CREATE OR REPLACE FUNCTION analytics_summary()
+RETURNS JSON
+LANGUAGE sql
+STABLE
+AS $$
+    -- Totals come from a single scan; each top-10 list is ordered and limited in Postgres
+    SELECT json_build_object(
+        'total_replies', totals.replies,
+        'total_upvotes', totals.upvotes,
+        'avg_upvotes', totals.avg_upvotes,
+        'best_subreddits', COALESCE((
+            SELECT json_agg(t) FROM (
+                SELECT COALESCE(subreddit, 'unknown') AS subreddit,
+                       COUNT(*) AS replies,
+                       ROUND(AVG(COALESCE(current_score, 0))::numeric, 1) AS avg_score
+                FROM comment_metrics
+                GROUP BY 1
+                ORDER BY avg_score DESC
+                LIMIT 10
+            ) t
+        ), '[]'::json),
+        'best_personas', COALESCE((
+            SELECT json_agg(t) FROM (
+                SELECT COALESCE(persona, 'unknown') AS persona,
+                       COUNT(*) AS replies,
+                       ROUND(AVG(COALESCE(current_score, 0))::numeric, 1) AS avg_score
+                FROM comment_metrics
+                GROUP BY 1
+                ORDER BY avg_score DESC
+                LIMIT 10
+            ) t
+        ), '[]'::json)
+    )
+    FROM (
+        SELECT COUNT(*) AS replies,
+               COALESCE(SUM(current_score), 0) AS upvotes,
+               COALESCE(ROUND(AVG(COALESCE(current_score, 0))::numeric, 1), 0) AS avg_upvotes
+        FROM comment_metrics
+    ) totals;
+$$;
+
+-- Bulk score refresh as a single UPDATE; only existing rows are touched
+-- (called via client.rpc("update_comment_scores", {"scores": {opportunity_id: score}, "updated_at": ...}))
+CREATE OR REPLACE FUNCTION update_comment_scores(scores JSONB, updated_at TEXT)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH updated AS (
+        UPDATE comment_metrics m
+        SET current_score = s.score::INTEGER,
+            last_updated = updated_at
+        FROM jsonb_each_text(scores) AS s(opportunity_id, score)
+        WHERE m.opportunity_id = s.opportunity_id
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM updated;
+$$;
+
+-- Atomically advance the subreddit rotation and return the batch bounds
+-- (called via client.rpc("advance_scan_index", {"subreddits": [...], "batch_size": n}))
+-- The batch is subreddits[start_idx:end_idx] + subreddits[:wrap_count] (0-based, end exclusive)
+CREATE OR REPLACE FUNCTION advance_scan_index(subreddits TEXT[], batch_size INTEGER)
+RETURNS TABLE(start_idx INTEGER, end_idx INTEGER, wrap_count INTEGER, new_next_index INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    total INTEGER := cardinality(subreddits);
+BEGIN
+    INSERT INTO scan_state (id, next_index) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+    SELECT COALESCE(s.next_index, 0) INTO start_idx FROM scan_state s WHERE s.id = 1 FOR UPDATE;
+    
+    IF start_idx >= total THEN
+        start_idx := 0;
+    END IF;
+    end_idx := LEAST(start_idx + batch_size, total);
+    
+    -- If the batch runs off the end, wrap around to fill it from the start
+    IF end_idx - start_idx < batch_size AND start_idx > 0 THEN
+        wrap_count := batch_size - (end_idx - start_idx);
+        new_next_index := wrap_count;
+    ELSE
+        wrap_count := 0;
+        new_next_index := CASE WHEN end_idx < total THEN end_idx ELSE 0 END;
+    END IF;
+    
+    UPDATE scan_state s
+    SET next_index = new_next_index,
+        last_scan = NOW()::TEXT,
+        last_batch = to_jsonb(subreddits[start_idx + 1:end_idx] || subreddits[1:wrap_count])
+    WHERE s.id = 1;
+    
+    RETURN NEXT;
+END;
+$$;
@@ -4,9 +4,15 @@ Replaces local_storage.py for production deployment
 """
 
 import os
-import hashlib
+import time
+import random
+import heapq
+import httpx
+from collections import defaultdict
 from datetime import datetime
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
+import xxhash
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,6 +23,24 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
 _supabase_client: Client = None
 
+# Rows per upsert request: big enough to amortize the round-trip, small enough to stay well under
+# PostgREST's body size limit and Postgres' 65535 bind parameters (~25 columns per opportunity)
+_UPSERT_CHUNK = 500
+
+# Scan rotation state, loaded once. Rotation advances are written behind (see flush_scan_state)
+_scan_state_cache = None
+_scan_state_dirty = False
+
+# Cleared once opportunities.has_replied turns out not to exist (database set up before it was added)
+_has_replied_column = True
+
+# HTTP statuses (and PostgREST error codes for the database being unreachable) worth retrying
+_RETRYABLE_STATUSES = {429, 502, 503, 504}
+_RETRYABLE_POSTGREST_CODES = {"PGRST000", "PGRST001", "PGRST002", "PGRST003"}
+
+# Cleared once advance_scan_index turns out not to be installed, so later scans don't call a missing function
+_rotation_rpc_available = True
+
 
 def get_client() -> Client:
     """Get or create Supabase client."""
@@ -25,89 +49,207 @@ def get_client() -> Client:
         if not SUPABASE_URL or not SUPABASE_KEY:
             raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set")
         _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        _configure_pool(_supabase_client)
     return _supabase_client
 
 
+def _configure_pool(client: Client) -> None:
+    """
+    Swap the PostgREST session for a keep-alive pooled one so small queries skip TCP/TLS handshakes.
+    The SDK has no option for pool limits, so this replaces client.postgrest.session (an SDK internal).
+    Base URL, auth headers and redirect handling are carried over; the SDK's timeout is replaced by ours.
+    """
+    try:
+        session = client.postgrest.session
+        client.postgrest.session = httpx.Client(
+            base_url=session.base_url,
+            headers=session.headers,
+            follow_redirects=session.follow_redirects,
+            timeout=30.0,
+            event_hooks={"response": [_raise_for_retryable_status]},
+            # httpx ignores the client's limits when a transport is passed, so they go on the transport
+            transport=httpx.HTTPTransport(
+                retries=3,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=40, keepalive_expiry=40),
+            ),
+        )
+        session.close()
+    except Exception as e:
+        # Internals differ across SDK versions; the default session still works
+        print(f"Could not configure Supabase connection pool: {e}")
+
+
+def _raise_for_retryable_status(response: httpx.Response) -> None:
+    """
+    Response hook: surface rate-limit/gateway statuses as httpx.HTTPStatusError.
+    postgrest's APIError only carries the PostgREST/SQLSTATE code, not the HTTP status.
+    """
+    if response.status_code in _RETRYABLE_STATUSES:
+        response.raise_for_status()
+
+
+def _is_transient(error: Exception) -> bool:
+    """Network failures, rate limits and gateway errors are worth retrying; anything else is a real error."""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in _RETRYABLE_STATUSES
+    if isinstance(error, APIError):
+        # PostgREST's own connection/pool errors; the status code only shows up here for non-JSON bodies
+        return error.code in _RETRYABLE_POSTGREST_CODES or error.code in {str(s) for s in _RETRYABLE_STATUSES}
+    return False
+
+
+def _is_missing_function(error: APIError) -> bool:
+    """True if PostgREST rejected an RPC because the SQL function doesn't exist."""
+    return error.code in ("PGRST202", "42883")
+
+
+def _is_missing_column(error: APIError) -> bool:
+    """True if PostgREST rejected a query because a column doesn't exist."""
+    return error.code in ("PGRST204", "42703")
+
+
+def _retry(fn, *, retries: int = 5, base: float = 0.2, cap: float = 10.0):
+    """
+    Call fn (usually a query's .execute), retrying transient failures with exponential backoff and jitter.
+    Only wrap idempotent calls, and call this from worker threads: the backoff sleeps block.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not _is_transient(e):
+                raise
+            time.sleep(min(cap, base * 2 ** attempt) + random.uniform(0, base))
+
+
 def generate_id(url: str) -> str:
     """Generate unique ID from URL."""
-    return hashlib.md5(url.encode()).hexdigest()[:12]
+    # Non-cryptographic dedup key; xxh3 is much faster than md5. Always xxh3, since ids are persisted.
+    return xxhash.xxh3_64_hexdigest(url.encode())[:12]
 
 
 def get_all_opportunities():
     """Get all opportunities from Supabase."""
     client = get_client()
-    response = client.table("opportunities").select("*").order("created_at", desc=True).execute()
+    response = _retry(client.table("opportunities").select("*").order("created_at", desc=True).execute)
     return response.data or []
 
 
-def get_existing_urls():
-    """Get set of existing URLs to avoid duplicates."""
+def get_opportunity(opportunity_id: str):
+    """Get a single opportunity by id, or None if it doesn't exist."""
     client = get_client()
-    response = client.table("opportunities").select("url").execute()
-    return {item["url"] for item in (response.data or [])}
+    response = _retry(client.table("opportunities").select("*").eq("id", opportunity_id).limit(1).execute)
+    return response.data[0] if response.data else None
 
 
-def append_opportunities(new_opportunities: list):
-    """Add new opportunities to Supabase."""
+def append_opportunities(new_opportunities: list) -> int:
+    """Add new opportunities to Supabase, skipping URLs already stored. Returns the number inserted."""
+    if not new_opportunities:
+        return 0
     client = get_client()
+    # All opportunities in a batch share one scan time
+    scan_time = datetime.now().isoformat()
     
     for opp in new_opportunities:
         opp["id"] = generate_id(opp["url"])
-        opp["scan_time"] = datetime.now().isoformat()
-        if "status" not in opp:
-            opp["status"] = "pending"
-        if "reply_url" not in opp:
-            opp["reply_url"] = ""
+        opp["scan_time"] = scan_time
+        opp.setdefault("status", "pending")
+        opp.setdefault("reply_url", "")
     
-    if new_opportunities:
-        client.table("opportunities").upsert(new_opportunities, on_conflict="id").execute()
+    # ON CONFLICT (url) DO NOTHING: the unique index does the dedup, and rows that already
+    # exist keep their status/replies instead of being overwritten by a re-scan
+    inserted = 0
+    for i in range(0, len(new_opportunities), _UPSERT_CHUNK):
+        response = _retry(client.table("opportunities").upsert(
+            new_opportunities[i:i + _UPSERT_CHUNK], on_conflict="url", ignore_duplicates=True
+        ).execute)
+        inserted += len(response.data or [])
+    return inserted
 
 
 def update_opportunity_status(opportunity_id: str, status: str):
     """Update status of an opportunity."""
     client = get_client()
-    client.table("opportunities").update({"status": status}).eq("id", opportunity_id).execute()
+    _retry(client.table("opportunities").update({"status": status}).eq("id", opportunity_id).execute)
 
 
 def save_reply_url(opportunity_id: str, reply_url: str):
     """Save reply URL and mark as replied."""
+    global _has_replied_column
     client = get_client()
-    client.table("opportunities").update({
+    fields = {
         "reply_url": reply_url,
         "status": "replied",
         "reply_timestamp": datetime.now().isoformat()
-    }).eq("id", opportunity_id).execute()
+    }
+    if _has_replied_column:
+        try:
+            _retry(client.table("opportunities").update({**fields, "has_replied": bool(reply_url)}).eq("id", opportunity_id).execute)
+            return
+        except APIError as e:
+            if not _is_missing_column(e):
+                raise
+            print(f"opportunities.has_replied missing (re-run supabase_setup.sql): {e}")
+            _has_replied_column = False
+    _retry(client.table("opportunities").update(fields).eq("id", opportunity_id).execute)
 
 
 def get_tracked_replies():
     """Get opportunities that have been replied to."""
+    global _has_replied_column
     client = get_client()
-    response = client.table("opportunities").select("*").neq("reply_url", "").execute()
+    if _has_replied_column:
+        try:
+            response = _retry(client.table("opportunities").select("*").eq("has_replied", True).execute)
+            return response.data or []
+        except APIError as e:
+            if not _is_missing_column(e):
+                raise
+            print(f"opportunities.has_replied missing (re-run supabase_setup.sql): {e}")
+            _has_replied_column = False
+    response = _retry(client.table("opportunities").select("*").neq("reply_url", "").execute)
     return response.data or []
 
 
 def save_feedback(opportunity_id: str, feedback: str):
     """Save feedback for an opportunity and mark as skipped."""
     client = get_client()
-    client.table("opportunities").update({
+    _retry(client.table("opportunities").update({
         "feedback": feedback,
         "status": "skipped"
-    }).eq("id", opportunity_id).execute()
+    }).eq("id", opportunity_id).execute)
 
 
 def _load_scan_state():
-    """Load scan state from Supabase."""
+    """Load scan state, fetching it from Supabase only on first use."""
+    global _scan_state_cache
+    if _scan_state_cache is not None:
+        return _scan_state_cache
+    
     client = get_client()
-    response = client.table("scan_state").select("*").eq("id", 1).execute()
+    response = _retry(client.table("scan_state").select("*").eq("id", 1).execute)
     if response.data:
-        return response.data[0]
-    return {"id": 1, "next_index": 0, "last_batch": None}
+        _scan_state_cache = response.data[0]
+    else:
+        _scan_state_cache = {"id": 1, "next_index": 0, "last_batch": None}
+    return _scan_state_cache
 
 
 def _save_scan_state(state):
-    """Save scan state to Supabase."""
+    """Save scan state to Supabase and keep it as the in-memory copy."""
+    global _scan_state_cache, _scan_state_dirty
     client = get_client()
-    client.table("scan_state").upsert(state, on_conflict="id").execute()
+    _retry(client.table("scan_state").upsert(state, on_conflict="id").execute)
+    _scan_state_cache = state
+    _scan_state_dirty = False
+
+
+def flush_scan_state():
+    """Write a rotation advanced in memory back to Supabase; call once per scan cycle."""
+    if _scan_state_dirty:
+        _save_scan_state(_scan_state_cache)
 
 
 def reset_scan_state():
@@ -117,20 +259,58 @@ def reset_scan_state():
     return state
 
 
+def _batch_number(next_index: int, total_subreddits: int, batch_size: int) -> int:
+    """Batch number (1-indexed) of the batch that ended just before next_index."""
+    if next_index == 0:
+        # We just wrapped around, so we completed the last batch
+        return (total_subreddits + batch_size - 1) // batch_size
+    # Current batch is based on next_index
+    return (next_index + batch_size - 1) // batch_size
+
+
 def get_current_batch_number(total_subreddits: int, batch_size: int = 3) -> int:
     """Get the current batch number (1-indexed) based on scan state."""
     state = _load_scan_state()
-    next_index = state.get("next_index", 0)
+    return _batch_number(state.get("next_index", 0), total_subreddits, batch_size)
+
+
+def get_next_subreddits(all_subreddits: list, batch_size: int = 3) -> tuple:
+    """
+    Get next batch of subreddits to scan, rotating through the list.
+    Returns (batch, current_batch, total_batches) so callers don't need to re-read the scan state.
+    The rotation is advanced atomically in Postgres by advance_scan_index(), in one round-trip.
+    """
+    global _scan_state_cache, _rotation_rpc_available
+    if not _rotation_rpc_available:
+        return _advance_scan_state_locally(all_subreddits, batch_size)
     
-    if next_index == 0:
-        total_batches = (total_subreddits + batch_size - 1) // batch_size
-        return total_batches
-    else:
-        return (next_index + batch_size - 1) // batch_size
+    client = get_client()
+    try:
+        # Not retried: a retry after a commit whose response was lost would advance the rotation twice
+        response = client.rpc("advance_scan_index", {"subreddits": all_subreddits, "batch_size": batch_size}).execute()
+    except APIError as e:
+        if not _is_missing_function(e):
+            raise
+        # Function not installed yet (see supabase_setup.sql); advance the rotation client-side from now on
+        print(f"advance_scan_index RPC not installed, rotating in Python: {e}")
+        _rotation_rpc_available = False
+        return _advance_scan_state_locally(all_subreddits, batch_size)
+    row = response.data[0]
+    
+    batch = all_subreddits[row["start_idx"]:row["end_idx"]] + all_subreddits[:row["wrap_count"]]
+    _scan_state_cache = {"id": 1, "next_index": row["new_next_index"], "last_batch": batch}
+    
+    total = len(all_subreddits)
+    total_batches = (total + batch_size - 1) // batch_size
+    return batch, _batch_number(row["new_next_index"], total, batch_size), total_batches
 
 
-def get_next_subreddits(all_subreddits: list, batch_size: int = 3) -> list:
-    """Get next batch of subreddits to scan, rotating through the list."""
+def _advance_scan_state_locally(all_subreddits: list, batch_size: int) -> tuple:
+    """
+    Rotation of the scan state in memory; fallback for when the RPC isn't available.
+    The new state is only persisted by flush_scan_state(), so this makes no round-trips once loaded.
+    """
+    global _scan_state_dirty
     state = _load_scan_state()
     next_index = state.get("next_index", 0)
     
@@ -150,9 +330,32 @@ def get_next_subreddits(all_subreddits: list, batch_size: int = 3) -> list:
     
     state["last_scan"] = datetime.now().isoformat()
     state["last_batch"] = batch
-    _save_scan_state(state)
+    _scan_state_dirty = True
     
-    return batch
+    total_batches = (total + batch_size - 1) // batch_size
+    return batch, _batch_number(state["next_index"], total, batch_size), total_batches
+
+
+# ============== Subreddit Rules Functions ==============
+
+def load_subreddit_rules() -> dict:
+    """Load persisted subreddit rules as {subreddit: {"rules": ..., "fetched_at": epoch seconds}}."""
+    client = get_client()
+    response = _retry(client.table("subreddit_rules").select("*").execute)
+    return {
+        row["subreddit"]: {"rules": row["rules"], "fetched_at": row["fetched_at"]}
+        for row in (response.data or [])
+    }
+
+
+def save_subreddit_rules(subreddit: str, rules: dict, fetched_at: float):
+    """Persist the fetched rules for one subreddit."""
+    client = get_client()
+    _retry(client.table("subreddit_rules").upsert({
+        "subreddit": subreddit,
+        "rules": rules,
+        "fetched_at": fetched_at
+    }, on_conflict="subreddit").execute)
 
 
 # ============== Comment Metrics Functions ==============
@@ -160,7 +363,7 @@ def get_next_subreddits(all_subreddits: list, batch_size: int = 3) -> list:
 def save_comment_metric(opportunity_id: str, reply_url: str, subreddit: str, persona: str, initial_score: int):
     """Save initial metrics when a reply URL is saved."""
     client = get_client()
-    client.table("comment_metrics").upsert({
+    _retry(client.table("comment_metrics").upsert({
         "opportunity_id": opportunity_id,
         "reply_url": reply_url,
         "subreddit": subreddit,
@@ -168,29 +371,74 @@ def save_comment_metric(opportunity_id: str, reply_url: str, subreddit: str, per
         "initial_score": initial_score,
         "current_score": initial_score,
         "last_updated": datetime.now().isoformat()
-    }, on_conflict="opportunity_id").execute()
+    }, on_conflict="opportunity_id").execute)
 
 
 def update_comment_score(opportunity_id: str, current_score: int):
     """Update the current score for a tracked comment."""
     client = get_client()
-    client.table("comment_metrics").update({
+    _retry(client.table("comment_metrics").update({
         "current_score": current_score,
         "last_updated": datetime.now().isoformat()
-    }).eq("opportunity_id", opportunity_id).execute()
+    }).eq("opportunity_id", opportunity_id).execute)
+
+
+def update_comment_scores(scores: dict):
+    """
+    Update current scores for many tracked comments at once, given {opportunity_id: score}.
+    Update-only: rows deleted since they were read are not recreated.
+    """
+    if not scores:
+        return
+    last_updated = datetime.now().isoformat()
+    client = get_client()
+    items = list(scores.items())
+    try:
+        for i in range(0, len(items), _UPSERT_CHUNK):
+            _retry(client.rpc("update_comment_scores", {
+                "scores": dict(items[i:i + _UPSERT_CHUNK]),
+                "updated_at": last_updated
+            }).execute)
+    except APIError as e:
+        if not _is_missing_function(e):
+            raise
+        # Function not installed yet (see supabase_setup.sql); update row by row instead
+        print(f"update_comment_scores RPC not installed, updating one row at a time: {e}")
+        for opportunity_id, score in items:
+            update_comment_score(opportunity_id, score)
 
 
 def get_all_comment_metrics():
     """Get all comment metrics for analytics."""
     client = get_client()
-    response = client.table("comment_metrics").select("*").order("created_at", desc=True).execute()
+    response = _retry(client.table("comment_metrics").select("*").order("created_at", desc=True).execute)
     return response.data or []
 
 
 def get_analytics_summary():
-    """Get aggregated analytics data."""
-    metrics = get_all_comment_metrics()
-    
+    """Get aggregated analytics data, computed in Postgres by the analytics_summary() function."""
+    client = get_client()
+    try:
+        response = _retry(client.rpc("analytics_summary").execute)
+        if response.data:
+            return response.data
+    except APIError as e:
+        if not _is_missing_function(e):
+            raise
+        # Function not installed yet (see supabase_setup.sql); aggregate client-side instead
+        print(f"analytics_summary RPC not installed, aggregating in Python: {e}")
+    return _summarize_metrics(_get_metrics_for_analytics())
+
+
+def _get_metrics_for_analytics():
+    """Get only the comment metric columns the analytics aggregation reads."""
+    client = get_client()
+    response = _retry(client.table("comment_metrics").select("subreddit,persona,current_score").execute)
+    return response.data or []
+
+
+def _summarize_metrics(metrics: list) -> dict:
+    """Aggregate comment metrics in Python; fallback for when the RPC isn't available."""
     if not metrics:
         return {
             "total_replies": 0,
@@ -200,44 +448,37 @@ def get_analytics_summary():
             "best_personas": []
         }
     
+    # One pass accumulating [count, total_score] per subreddit and per persona
+    total_upvotes = 0
+    subreddit_stats = defaultdict(lambda: [0, 0])
+    persona_stats = defaultdict(lambda: [0, 0])
+    for m in metrics:
+        score = m.get("current_score", 0)
+        total_upvotes += score
+        sub = subreddit_stats[m.get("subreddit", "unknown")]
+        sub[0] += 1
+        sub[1] += score
+        persona = persona_stats[m.get("persona", "unknown")]
+        persona[0] += 1
+        persona[1] += score
+    
     total_replies = len(metrics)
-    total_upvotes = sum(m.get("current_score", 0) for m in metrics)
-    avg_upvotes = total_upvotes / total_replies if total_replies > 0 else 0
+    avg_upvotes = total_upvotes / total_replies
     
-    # Group by subreddit
-    subreddit_stats = {}
-    for m in metrics:
-        sub = m.get("subreddit", "unknown")
-        if sub not in subreddit_stats:
-            subreddit_stats[sub] = {"count": 0, "total_score": 0}
-        subreddit_stats[sub]["count"] += 1
-        subreddit_stats[sub]["total_score"] += m.get("current_score", 0)
-    
-    best_subreddits = [
-        {"subreddit": k, "replies": v["count"], "avg_score": round(v["total_score"] / v["count"], 1)}
-        for k, v in subreddit_stats.items()
-    ]
-    best_subreddits.sort(key=lambda x: x["avg_score"], reverse=True)
-    
-    # Group by persona
-    persona_stats = {}
-    for m in metrics:
-        persona = m.get("persona", "unknown")
-        if persona not in persona_stats:
-            persona_stats[persona] = {"count": 0, "total_score": 0}
-        persona_stats[persona]["count"] += 1
-        persona_stats[persona]["total_score"] += m.get("current_score", 0)
-    
-    best_personas = [
-        {"persona": k, "replies": v["count"], "avg_score": round(v["total_score"] / v["count"], 1)}
-        for k, v in persona_stats.items()
-    ]
-    best_personas.sort(key=lambda x: x["avg_score"], reverse=True)
+    best_subreddits = heapq.nlargest(10, (
+        {"subreddit": k, "replies": count, "avg_score": round(total / count, 1)}
+        for k, (count, total) in subreddit_stats.items()
+    ), key=lambda x: x["avg_score"])
+    
+    best_personas = heapq.nlargest(10, (
+        {"persona": k, "replies": count, "avg_score": round(total / count, 1)}
+        for k, (count, total) in persona_stats.items()
+    ), key=lambda x: x["avg_score"])
     
     return {
         "total_replies": total_replies,
         "total_upvotes": total_upvotes,
         "avg_upvotes": round(avg_upvotes, 1),
-        "best_subreddits": best_subreddits[:10],
-        "best_personas": best_personas[:10]
+        "best_subreddits": best_subreddits,
+        "best_personas": best_personas
     }